@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic stems for benchmarks.
+
+Percussive stems are click tracks (decaying noise bursts on every beat)
+and harmonic stems are sequences of decaying tones on every beat, so
+feature extraction finds a stable tempo and a clear sound class. The
+corpus only depends on its parameters: the same call always writes the
+same files.
+
+Usage::
+
+    python benchmarks/corpus.py --output_folder /tmp/corpus --n_stems 64
+"""
+import argparse
+import os
+
+import numpy as np
+import soundfile as sf
+
+TEMPOS = [80, 100, 120, 160]
+PITCHES = [220.0, 275.0, 330.0, 440.0]
+
+
+def click_track(tempo, duration, sr, rng):
+    r"""
+    Percussive stem with a decaying noise burst on every beat
+
+    Parameters
+    ----------
+    tempo : float
+        tempo in BPM
+    duration : float
+        duration in seconds
+    sr : int
+        sample rate
+    rng : np.random.Generator
+
+    Returns
+    -------
+    y : np.ndarray
+    """
+    y = np.zeros(int(duration * sr), dtype=np.float32)
+    length = int(0.05 * sr)
+    burst = rng.standard_normal(length) * np.exp(-np.arange(length) / (0.005 * sr))
+
+    for beat in np.arange(0.25, duration, 60.0 / tempo):
+        start = int(beat * sr)
+        end = min(start + length, len(y))
+        y[start:end] += burst[: end - start]
+
+    return y
+
+
+def tone_track(tempo, duration, sr, rng):
+    r"""
+    Harmonic stem with a decaying tone on every beat
+
+    Parameters
+    ----------
+    tempo : float
+        tempo in BPM
+    duration : float
+        duration in seconds
+    sr : int
+        sample rate
+    rng : np.random.Generator
+
+    Returns
+    -------
+    y : np.ndarray
+    """
+    y = np.zeros(int(duration * sr), dtype=np.float32)
+    length = int(60.0 / tempo * sr)
+    t = np.arange(length) / sr
+    envelope = np.exp(-t / 0.4)
+    pitches = rng.permutation(PITCHES)
+
+    for i, beat in enumerate(np.arange(0.25, duration, 60.0 / tempo)):
+        start = int(beat * sr)
+        end = min(start + length, len(y))
+        tone = np.sin(2 * np.pi * pitches[i % len(pitches)] * t) * envelope
+        y[start:end] += tone[: end - start]
+
+    return y
+
+
+def make_corpus(
+    output_folder, n_stems, durations=(10.0, 30.0), sample_rates=(44100,), seed=0
+):
+    r"""
+    Write a corpus of synthetic stems
+
+    Stems alternate between percussive and harmonic and cycle through
+    `TEMPOS`. Every full cycle of tempos uses the next duration of
+    `durations`, and every cycle of durations the next sample rate of
+    `sample_rates`. Existing files are kept, so
+    growing a corpus only writes the new stems.
+
+    Parameters
+    ----------
+    output_folder : str
+        folder where stems are written
+    n_stems : int
+        number of stems
+    durations : list[float]
+        durations of the stems in seconds
+    sample_rates : list[int]
+        sample rates of the stems
+    seed : int
+        seed of the noise and pitches
+
+    Returns
+    -------
+    stem_names : list[str]
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    stem_names = []
+    for i in range(n_stems):
+        percussive = i % 2 == 0
+        cycle = i // (2 * len(TEMPOS))
+        tempo = TEMPOS[(i // 2) % len(TEMPOS)]
+        duration = durations[cycle % len(durations)]
+        sr = sample_rates[(cycle // len(durations)) % len(sample_rates)]
+
+        stem_name = f"{'perc' if percussive else 'harm'}{i:05d}.wav"
+        stem_names.append(stem_name)
+        stem_path = os.path.join(output_folder, stem_name)
+        if os.path.exists(stem_path):
+            continue
+
+        rng = np.random.default_rng([seed, i])
+        track = click_track if percussive else tone_track
+        y = track(tempo, duration, sr, rng)
+        sf.write(stem_path, 0.5 * y / np.abs(y).max(), sr)
+
+    return stem_names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="corpus.py", description="Generate synthetic stems for benchmarks"
+    )
+    parser.add_argument(
+        "--output_folder", required=True, help="folder where stems are written"
+    )
+    parser.add_argument(
+        "--n_stems", required=False, default=64, help="number of stems", type=int
+    )
+    parser.add_argument(
+        "--durations",
+        required=False,
+        default=[10.0, 30.0],
+        nargs="+",
+        help="durations of the stems in seconds",
+        type=float,
+    )
+    parser.add_argument(
+        "--sample_rates",
+        required=False,
+        default=[44100],
+        nargs="+",
+        help="sample rates of the stems",
+        type=int,
+    )
+    parser.add_argument(
+        "--seed", required=False, default=0, help="random seed", type=int
+    )
+
+    args = parser.parse_args()
+    make_corpus(**vars(args))
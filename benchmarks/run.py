@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the indexing and mixing hot paths.
+
+For every library size, a synthetic corpus (see ``corpus.py``) is indexed
+and mixed:
+
+- ``index``: full `metadata.process` and a no-op incremental update.
+- ``stages``: per-call time of `StemSampler.sample`, `time_stretch`,
+  `align_first_beat`, `mix` and `save_mixture`, run one after the other in
+  the current process.
+- ``generate``: end-to-end `generate_mixtures` for every worker count,
+  with mixtures per second, the per-stage times of `Profiler` and the peak
+  RSS of the run and of its worker processes.
+
+``cold_start`` measures, in fresh interpreters, the time to import
+`stem_mixer.mix`, to print the CLI help, to run `warm_up` and to render a
+single mixture with the CLI.
+
+Every ``generate`` configuration runs in a fresh process, so peak RSS and
+start-up costs are measured in isolation. Results are saved as a flat
+JSON dictionary of metrics, which can be compared against a baseline::
+
+    python benchmarks/run.py --save_baseline baseline.json
+    python benchmarks/run.py --baseline baseline.json
+
+The second command exits with status 1 if a metric regressed by more than
+``--tolerance``.
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from corpus import make_corpus
+from stem_mixer import metadata
+from stem_mixer.mix import (
+    StemSampler, align_first_beat, generate_mixtures, mix, save_mixture, time_stretch
+)
+from stem_mixer.profiling import Profiler
+
+
+def bench_index(data_home, jobs=1):
+    r"""
+    Time a full and an incremental index build
+
+    Parameters
+    ----------
+    data_home : str
+        corpus folder. any existing index is removed.
+    jobs : int
+        number of feature extraction processes
+
+    Returns
+    -------
+    results : dict
+    """
+    for f in os.listdir(data_home):
+        if not f.endswith(".wav"):
+            os.remove(os.path.join(data_home, f))
+
+    start = time.perf_counter()
+    metadata.process(data_home, jobs=jobs)
+    full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    metadata.process(data_home, jobs=jobs)
+    incremental = time.perf_counter() - start
+
+    n_stems = len(metadata.stem_stats(data_home))
+
+    return {
+        "full_seconds": full,
+        "incremental_seconds": incremental,
+        "stems_per_second": n_stems / full,
+    }
+
+
+def bench_stages(data_home, n_mixtures, duration=5.0, sr=22050, seed=0):
+    r"""
+    Time every step of a mixture in the current process
+
+    Parameters
+    ----------
+    data_home : str
+        indexed corpus folder
+    n_mixtures : int
+        number of mixtures
+    duration : float
+        mixture duration
+    sr : int
+        sample rate
+    seed : int
+        random seed
+
+    Returns
+    -------
+    results : dict
+        mean time per mixture of every step, in milliseconds
+    """
+    sampler = StemSampler.from_file(data_home)
+    rng = np.random.default_rng(seed)
+    times = {
+        name: []
+        for name in ["sample", "time_stretch", "align_first_beat", "mix", "save_mixture"]
+    }
+
+    def timed(name, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        times[name].append(time.perf_counter() - start)
+        return result
+
+    with tempfile.TemporaryDirectory() as output_folder:
+        for _ in range(n_mixtures):
+            stems, base_tempo = timed("sample", sampler.sample, 2, 1, rng=rng)
+            stems = timed(
+                "time_stretch", time_stretch, stems, base_tempo, duration, sr=sr, rng=rng
+            )
+            stems = timed("align_first_beat", align_first_beat, stems, sr=sr)
+            mixture, stems = timed("mix", mix, duration, stems, sr=sr)
+            timed("save_mixture", save_mixture, output_folder, mixture, stems, sr=sr)
+
+    # the first mixture pays for numba compilation and caches
+    return {f"{name}_ms": 1000 * np.mean(t[1:] or t) for name, t in times.items()}
+
+
+def bench_generate(data_home, n_mixtures, workers, duration=5.0, sr=22050, seed=0):
+    r"""
+    Time `generate_mixtures` end to end
+
+    Parameters
+    ----------
+    data_home : str
+        indexed corpus folder
+    n_mixtures : int
+        number of mixtures
+    workers : int
+        number of worker processes
+    duration : float
+        mixture duration
+    sr : int
+        sample rate
+    seed : int
+        random seed
+
+    Returns
+    -------
+    results : dict
+    """
+    start = time.perf_counter()
+    profiler = Profiler()
+
+    with tempfile.TemporaryDirectory() as output_folder:
+        generate_mixtures(
+            data_home,
+            n_mixtures,
+            3,
+            1,
+            2,
+            duration,
+            output_folder=output_folder,
+            workers=workers,
+            seed=seed,
+            sr=sr,
+            profiler=profiler,
+        )
+
+    wall = time.perf_counter() - start
+    summary = profiler.summary()
+
+    results = {
+        "mixtures_per_second": n_mixtures / wall,
+        # kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_worker_rss_mb": (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        ),
+    }
+    for name, stage in summary["stages"].items():
+        results[f"{name}_seconds"] = stage["seconds"]
+
+    return results
+
+
+def bench_cold_start(data_home, sr=22050, repeat=3):
+    r"""
+    Time the start-up of fresh Python processes
+
+    Parameters
+    ----------
+    data_home : str
+        indexed corpus folder
+    sr : int
+        sample rate
+    repeat : int
+        every command is run `repeat` times and the fastest run is kept
+
+    Returns
+    -------
+    results : dict
+    """
+    # run from the repository root, so stem_mixer does not need to be installed
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+
+    def run(*args):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, *args], env=env, capture_output=True, text=True, check=True
+        )
+        return time.perf_counter() - start, process.stdout
+
+    results = {
+        "import_seconds": min(
+            run("-c", "import stem_mixer.mix")[0] for _ in range(repeat)
+        ),
+        "cli_help_seconds": min(
+            run("-m", "stem_mixer.mix", "--help")[0] for _ in range(repeat)
+        ),
+    }
+
+    warm_up = (
+        "import time\n"
+        "from stem_mixer.mix import warm_up\n"
+        "start = time.perf_counter()\n"
+        f"warm_up({sr})\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    results["warm_up_seconds"] = min(
+        float(run("-c", warm_up)[1]) for _ in range(repeat)
+    )
+
+    first_mixture = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as output_folder:
+            first_mixture.append(
+                run(
+                    "-m", "stem_mixer.mix",
+                    "--data_home", data_home,
+                    "--output_folder", output_folder,
+                    "--n_mixtures", "1",
+                    "--n_stems", "3",
+                    "--sr", str(sr),
+                )[0]
+            )
+    results["first_mixture_seconds"] = min(first_mixture)
+
+    return results
+
+
+def run_isolated(function, *args, **kwargs):
+    r"""
+    Run a benchmark in a fresh process
+
+    Parameters
+    ----------
+    function : callable
+    \*args, \*\*kwargs
+        arguments of `function`
+
+    Returns
+    -------
+    result
+        return value of `function`
+    """
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(function, *args, **kwargs).result()
+
+
+def compare(results, baseline, tolerance=0.2):
+    r"""
+    Find the metrics that regressed compared to a baseline
+
+    Metrics ending with ``per_second`` are better when higher, every other
+    metric is better when lower.
+
+    Parameters
+    ----------
+    results : dict
+        metric name -> value
+    baseline : dict
+        metric name -> value
+    tolerance : float
+        relative change allowed before a metric is a regression
+
+    Returns
+    -------
+    regressions : dict
+        metric name -> (baseline value, new value)
+    """
+    regressions = {}
+    for name, value in results.items():
+        if name not in baseline or not baseline[name]:
+            continue
+
+        change = (value - baseline[name]) / baseline[name]
+        if name.endswith("per_second"):
+            change = -change
+
+        if change > tolerance:
+            regressions[name] = (baseline[name], value)
+
+    return regressions
+
+
+def main(
+    data_home,
+    library_sizes,
+    workers,
+    n_mixtures,
+    duration,
+    sr,
+    jobs,
+    seed,
+):
+    r"""
+    Run all benchmarks
+
+    Returns
+    -------
+    results : dict
+        metric name -> value. names are ``<benchmark>/<library size>/...``
+    """
+    results = {}
+    for size in library_sizes:
+        corpus = os.path.join(data_home, str(size))
+        make_corpus(corpus, size, seed=seed)
+
+        print(f"library of {size} stems")
+        for name, value in bench_index(corpus, jobs=jobs).items():
+            results[f"index/{size}/{name}"] = value
+
+        for name, value in bench_cold_start(corpus, sr).items():
+            results[f"cold_start/{size}/{name}"] = value
+
+        stages = run_isolated(bench_stages, corpus, n_mixtures, duration, sr, seed)
+        for name, value in stages.items():
+            results[f"stages/{size}/{name}"] = value
+
+        for w in workers:
+            generate = run_isolated(
+                bench_generate, corpus, n_mixtures, w, duration, sr, seed
+            )
+            for name, value in generate.items():
+                results[f"generate/{size}/workers={w}/{name}"] = value
+
+        for name, value in results.items():
+            if f"/{size}/" in name:
+                print(f"  {name:<55}{value:>12.3f}")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="run.py", description="Benchmark indexing and mixing"
+    )
+    parser.add_argument(
+        "--data_home",
+        required=False,
+        default=None,
+        help="folder where the synthetic corpora are kept. temporary if not provided",
+    )
+    parser.add_argument(
+        "--library_sizes",
+        required=False,
+        default=[16, 64],
+        nargs="+",
+        help="number of stems of every corpus",
+        type=int,
+    )
+    parser.add_argument(
+        "--workers",
+        required=False,
+        default=[1, 2],
+        nargs="+",
+        help="worker counts of the end-to-end benchmark",
+        type=int,
+    )
+    parser.add_argument(
+        "--n_mixtures",
+        required=False,
+        default=20,
+        help="number of mixtures per benchmark",
+        type=int,
+    )
+    parser.add_argument(
+        "--duration", required=False, default=5.0, help="mixture duration", type=float
+    )
+    parser.add_argument(
+        "--sr", required=False, default=22050, help="sample rate", type=int
+    )
+    parser.add_argument(
+        "--jobs",
+        required=False,
+        default=1,
+        help="feature extraction processes when indexing",
+        type=int,
+    )
+    parser.add_argument(
+        "--seed", required=False, default=0, help="random seed", type=int
+    )
+    parser.add_argument(
+        "--output",
+        required=False,
+        default=None,
+        help="write the results to this JSON file",
+    )
+    parser.add_argument(
+        "--save_baseline",
+        required=False,
+        default=None,
+        help="save the results as a baseline to this JSON file",
+    )
+    parser.add_argument(
+        "--baseline",
+        required=False,
+        default=None,
+        help="compare the results against this baseline JSON file",
+    )
+    parser.add_argument(
+        "--tolerance",
+        required=False,
+        default=0.2,
+        help="relative change tolerated before a metric is a regression",
+        type=float,
+    )
+
+    args = parser.parse_args()
+    kwargs = vars(args)
+    output = kwargs.pop("output")
+    save_baseline = kwargs.pop("save_baseline")
+    baseline_file = kwargs.pop("baseline")
+    tolerance = kwargs.pop("tolerance")
+
+    temporary = kwargs["data_home"] is None
+    if temporary:
+        kwargs["data_home"] = tempfile.mkdtemp(prefix="stem_mixer_bench_")
+
+    try:
+        results = main(**kwargs)
+    finally:
+        if temporary:
+            shutil.rmtree(kwargs["data_home"])
+
+    report = {
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "parameters": kwargs,
+        "results": results,
+    }
+    for path in [output, save_baseline]:
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if baseline_file is not None:
+        with open(baseline_file) as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare(results, baseline, tolerance)
+        for name, (before, after) in regressions.items():
+            print(f"regression: {name} {before:.3f} -> {after:.3f}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regression above {tolerance:.0%}")
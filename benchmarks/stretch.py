@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Quality and speed of the time stretch backends.
+
+Every backend of `stem_mixer.mix.STRETCH_BACKENDS` stretches a synthetic
+click track (see ``corpus.py``) and a 440 Hz sine at several rates. For
+every backend and rate, it reports:
+
+- ``realtime``: seconds of input audio stretched per second of compute.
+- ``tempo_error_pct``: relative error between the tempo estimated on the
+  stretched click track and the target tempo.
+- ``pitch_cents``: pitch shift of the stretched sine, from the peak of its
+  spectrum. 0 for a pitch preserving stretch.
+
+Usage::
+
+    python benchmarks/stretch.py --rates 0.5 0.9 0.97 1.03 1.1 2.0
+"""
+import argparse
+import json
+import time
+
+import librosa
+import numpy as np
+
+from corpus import click_track
+from stem_mixer.mix import STRETCH_BACKENDS
+
+
+def peak_frequency(y, sr):
+    r"""
+    Frequency of the highest peak of the spectrum
+
+    Parameters
+    ----------
+    y : np.ndarray
+    sr : int
+
+    Returns
+    -------
+    frequency : float
+    """
+    spectrum = np.abs(np.fft.rfft(y * np.hanning(len(y))))
+    return np.argmax(spectrum) * sr / len(y)
+
+
+def bench_backend(backend, rate, tempo=100, duration=20.0, sr=22050, repeat=3):
+    r"""
+    Measure the speed and quality of a backend at a stretch rate
+
+    Parameters
+    ----------
+    backend : str
+        name of the backend in `STRETCH_BACKENDS`
+    rate : float
+        stretch rate
+    tempo : float
+        tempo of the input stems
+    duration : float
+        duration of the input stems in seconds
+    sr : int
+        sample rate
+    repeat : int
+        the fastest of `repeat` runs is kept
+
+    Returns
+    -------
+    results : dict
+    """
+    stretch = STRETCH_BACKENDS[backend]
+    rng = np.random.default_rng(0)
+    clicks = click_track(tempo, duration, sr, rng)
+    # a single pitch, so the spectrum has one clear peak
+    tones = np.sin(2 * np.pi * 440.0 * np.arange(int(duration * sr)) / sr)
+    tones = tones.astype(np.float32)
+
+    # first call compiles and caches
+    stretch(clicks, rate, sr)
+
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stretched = stretch(clicks, rate, sr)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    estimated_tempo, _ = librosa.beat.beat_track(
+        y=stretched, sr=sr, start_bpm=tempo * rate
+    )
+    estimated_tempo = float(np.atleast_1d(estimated_tempo)[0])
+
+    pitch = peak_frequency(stretch(tones, rate, sr), sr)
+
+    return {
+        "realtime": duration / seconds,
+        "tempo_error_pct": 100 * abs(estimated_tempo / (tempo * rate) - 1),
+        "pitch_cents": 1200 * np.log2(pitch / 440.0),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="stretch.py", description="Benchmark the time stretch backends"
+    )
+    parser.add_argument(
+        "--backends",
+        required=False,
+        default=list(STRETCH_BACKENDS),
+        nargs="+",
+        help="backends to benchmark",
+        type=str,
+    )
+    parser.add_argument(
+        "--rates",
+        required=False,
+        default=[0.5, 0.9, 0.97, 1.03, 1.1, 2.0],
+        nargs="+",
+        help="stretch rates",
+        type=float,
+    )
+    parser.add_argument(
+        "--duration",
+        required=False,
+        default=20.0,
+        help="duration of the input stems in seconds",
+        type=float,
+    )
+    parser.add_argument(
+        "--sr", required=False, default=22050, help="sample rate", type=int
+    )
+    parser.add_argument(
+        "--output",
+        required=False,
+        default=None,
+        help="write the results to this JSON file",
+    )
+
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'backend':<15}{'rate':>6}{'realtime':>10}{'tempo err %':>13}{'cents':>8}")
+    for backend in args.backends:
+        for rate in args.rates:
+            r = bench_backend(backend, rate, duration=args.duration, sr=args.sr)
+            results[f"{backend}/{rate}"] = r
+            print(
+                f"{backend:<15}{rate:>6.2f}{r['realtime']:>10.1f}"
+                f"{r['tempo_error_pct']:>13.2f}{r['pitch_cents']:>8.1f}"
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
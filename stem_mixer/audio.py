@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. autosummary::
+   :toctree: generated/
+
+   load
+"""
+import librosa
+import numpy as np
+import soundfile as sf
+
+
+def load(path, sr=22050, offset=0.0, duration=None):
+    r"""
+    Read a window of an audio file as mono.
+
+    Only the frames between `offset` and `offset + duration` are read:
+    the file is seeked to the first frame instead of being decoded from
+    the beginning.
+
+    Parameters
+    ----------
+    path : str
+        path to the audio file
+    sr : int or None
+        target sample rate. if None, the native sample rate is kept.
+    offset : float
+        start of the window in seconds
+    duration : float or None
+        length of the window in seconds. if None, read until the end.
+
+    Returns
+    -------
+    audio : np.ndarray
+        mono float32 audio
+    sr : int
+        sample rate of `audio`
+    """
+    with sf.SoundFile(path) as f:
+        native_sr = f.samplerate
+        start = min(int(round(offset * native_sr)), f.frames)
+        frames = -1 if duration is None else int(round(duration * native_sr))
+
+        f.seek(start)
+        audio = f.read(frames, dtype="float32", always_2d=True)
+
+    audio = np.mean(audio, axis=1)
+
+    if sr is not None and sr != native_sr:
+        audio = librosa.resample(audio, orig_sr=native_sr, target_sr=sr)
+    else:
+        sr = native_sr
+
+    return audio, sr
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. autosummary::
+   :toctree: generated/
+
+   AudioCache
+"""
+import hashlib
+import os
+import uuid
+
+import numpy as np
+
+
+class AudioCache:
+    r"""
+    On-disk cache of processed stem audio.
+
+    Each entry is a ``.npy`` file named after a hash of the stem path, its
+    modification time and the processing parameters, so editing a stem
+    invalidates its entries. Entries are read back memory-mapped. When
+    the cache grows over `max_size` bytes, the least recently used entries
+    are removed.
+
+    The cache is safe to share between processes: entries are written to a
+    temporary file and renamed into place.
+
+    Parameters
+    ----------
+    cache_dir : str
+        folder where entries are stored
+    max_size : int or None
+        maximum size of the cache in bytes. unlimited if None.
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # estimated size of the cache. other processes may also write to it,
+        # so it is refreshed from disk every time entries are evicted
+        self._size = None
+
+    def key(self, stem_path, **params):
+        r"""
+        Build the cache key of a stem
+
+        Parameters
+        ----------
+        stem_path : str
+            path to the audio stem file
+        \*\*params : dict
+            processing parameters (sample rate, duration, stretch rate...)
+
+        Returns
+        -------
+        key : str
+        """
+        stem_path = os.path.abspath(stem_path)
+        mtime = os.stat(stem_path).st_mtime_ns
+        fields = [stem_path, str(mtime)] + [
+            f"{name}={params[name]!r}" for name in sorted(params)
+        ]
+
+        return hashlib.sha1("\0".join(fields).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        r"""
+        Read an entry from the cache
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        audio : np.ndarray or None
+            read-only memory-mapped audio, or None if `key` is not cached
+        """
+        path = self._path(key)
+
+        try:
+            audio = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # mark entry as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return audio
+
+    def put(self, key, audio):
+        r"""
+        Write an entry to the cache
+
+        Parameters
+        ----------
+        key : str
+        audio : np.ndarray
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            np.save(f, audio)
+        os.replace(tmp_path, path)
+
+        if self.max_size is not None:
+            if self._size is not None:
+                self._size += os.path.getsize(path)
+
+            if self._size is None or self._size > self.max_size:
+                self.evict(self.max_size)
+
+        return
+
+    def evict(self, max_size):
+        r"""
+        Remove least recently used entries until the cache fits `max_size`
+
+        Parameters
+        ----------
+        max_size : int
+            maximum size of the cache in bytes
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        self._size = total
+
+        return
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
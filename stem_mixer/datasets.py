@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. autosummary::
+   :toctree: generated/
+
+   MixtureDataset
+   collate
+"""
+import itertools
+
+import numpy as np
+
+from stem_mixer.mix import StemSampler, iter_mixtures
+
+try:
+    from torch.utils.data import IterableDataset, default_collate, get_worker_info
+except ImportError:
+    # torch is optional: without it, MixtureDataset is a plain iterable
+    IterableDataset = object
+
+    def get_worker_info():
+        return None
+
+    def default_collate(batch):
+        return np.stack(batch)
+
+
+class MixtureDataset(IterableDataset):
+    r"""
+    Iterable dataset of mixtures generated on the fly.
+
+    Mixtures are split between processes first: rank ``r`` of
+    ``world_size`` renders mixtures ``start + r``,
+    ``start + r + world_size``... When iterated from several data loader
+    workers, every worker renders a disjoint slice of the mixtures of its
+    rank. The index is loaded once and shared by all workers.
+
+    The stems metadata holds values that torch's default collate function
+    cannot batch (such as None), so use `collate` as the ``collate_fn`` of
+    the data loader.
+
+    This is a ``torch.utils.data.IterableDataset`` when ``torch`` is
+    installed, and a plain iterable otherwise.
+
+    Parameters
+    ----------
+    data_home : str
+        path to stems
+    n_harmonic : int
+        number of harmonic stems
+    n_percussive : int
+        number of percussive stems
+    duration : float
+        mixture duration
+    n_mixtures : int or None
+        number of mixtures per epoch. if None, the dataset is infinite.
+    index_file : str
+        index file with pre-computed features
+    seed : int or None
+        if provided, every epoch yields the same mixtures
+    start : int
+        index of the first mixture
+    rank : int
+        rank of this process in distributed training
+    world_size : int
+        number of processes in distributed training. mixtures are split
+        between processes before being split between workers.
+    \*\*kwargs : dict
+        other `iter_mixtures` parameters (cache, sr, strategy...)
+
+    Examples
+    --------
+    >>> dataset = MixtureDataset("stems", 1, 2, 5.0, seed=0)
+    >>> loader = torch.utils.data.DataLoader(
+    ...     dataset, batch_size=16, num_workers=4, collate_fn=collate
+    ... )
+    >>> for mixtures, stem_matrices, metadata in loader:
+    ...     train_step(mixtures, stem_matrices)
+    """
+
+    def __init__(
+        self,
+        data_home,
+        n_harmonic,
+        n_percussive,
+        duration,
+        n_mixtures=None,
+        index_file="index.csv",
+        seed=None,
+        start=0,
+        rank=0,
+        world_size=1,
+        **kwargs
+    ):
+        self.sampler = StemSampler.from_file(data_home, index_file)
+        self.sampler.tempo_choices(n_harmonic, n_percussive)
+
+        self.n_harmonic = n_harmonic
+        self.n_percussive = n_percussive
+        self.duration = duration
+        self.n_mixtures = n_mixtures
+        self.seed = seed
+        self.start = start
+        self.rank = rank
+        self.world_size = world_size
+        self.kwargs = kwargs
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        if worker_info is None:
+            worker_id, num_workers = 0, 1
+        else:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+
+        # the mixtures of a rank do not depend on the number of workers
+        shard = self.rank + self.world_size * worker_id
+        n_shards = self.world_size * num_workers
+
+        mixtures = iter_mixtures(
+            self.n_harmonic,
+            self.n_percussive,
+            self.duration,
+            seed=self.seed,
+            start=self.start + shard,
+            step=n_shards,
+            sampler=self.sampler,
+            **self.kwargs
+        )
+
+        if self.n_mixtures is None:
+            return mixtures
+
+        # mixtures of this shard among the first n_mixtures
+        n_mixtures = len(range(shard, self.n_mixtures, n_shards))
+        return itertools.islice(mixtures, n_mixtures)
+
+    def __len__(self):
+        # number of mixtures of this rank per epoch
+        if self.n_mixtures is None:
+            raise TypeError("infinite MixtureDataset has no len()")
+        return len(range(self.rank, self.n_mixtures, self.world_size))
+
+
+def collate(batch):
+    r"""
+    Batch mixtures yielded by `MixtureDataset`
+
+    Mixtures and stem matrices are stacked by torch's default collate
+    function (``np.stack`` without torch). Metadata is kept as a list with
+    one dict per mixture.
+
+    Parameters
+    ----------
+    batch : list[tuple]
+        ``(mixture, stem_matrix, metadata)`` items
+
+    Returns
+    -------
+    mixtures : torch.Tensor or np.ndarray
+        ``(batch_size, n_samples)`` mixtures
+    stem_matrices : torch.Tensor or np.ndarray
+        ``(batch_size, n_stems, n_samples)`` stems
+    metadata : list[dict]
+    """
+    mixtures, stem_matrices, metadata = zip(*batch)
+
+    return default_collate(mixtures), default_collate(stem_matrices), list(metadata)
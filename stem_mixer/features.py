@@ -4,6 +4,7 @@
 .. autosummary::
    :toctree: generated/
 
+   extract
    tempo
    tempo_bin
    sound_class
@@ -12,6 +13,54 @@ import math
 
 import librosa
 import numpy as np
+import soundfile as sf
+
+
+def extract(stem_path, sr=22050, hpss=True):
+    r"""
+    Extracts all features from an audio stem file, decoding it only once.
+
+    Parameters
+    ----------
+    stem_path : str
+        path to the audio stem file.
+    sr : int
+        sample rate used for the analysis
+    hpss : bool
+        if False, skip the harmonic / percussive separation and return
+        ``sound_class=None``. useful when the sound class is already known.
+
+    Returns
+    -------
+    features : dict
+        dictionary with ``tempo``, ``tempo_bin``, ``sound_class``, ``rms``,
+        ``beat_times`` and ``first_beat_time`` (in seconds, None if no beat
+        was found), ``trim_start`` / ``trim_end``, the boundaries of the
+        stem without leading and trailing silence (in seconds), and
+        ``native_sr``, the sample rate of the file.
+    """
+
+    native_sr = sf.info(stem_path).samplerate
+    y, sr = librosa.load(stem_path, sr=sr, mono=True)
+    stem_tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
+    stem_tempo = float(np.atleast_1d(stem_tempo)[0])
+
+    beat_times = librosa.frames_to_time(beat_frames, sr=sr).tolist()
+    first_beat_time = beat_times[0] if len(beat_times) > 0 else None
+
+    _, (trim_start, trim_end) = librosa.effects.trim(y)
+
+    return {
+        "tempo": stem_tempo,
+        "tempo_bin": tempo_bin(stem_tempo),
+        "sound_class": _sound_class(y) if hpss else None,
+        "rms": float(np.sqrt(np.mean(np.square(y)))),
+        "beat_times": beat_times,
+        "first_beat_time": first_beat_time,
+        "trim_start": trim_start / sr,
+        "trim_end": trim_end / sr,
+        "native_sr": native_sr,
+    }
 
 
 def tempo(stem_path, sr=22050):
@@ -31,7 +80,7 @@ def tempo(stem_path, sr=22050):
 
     audio_file, sr = librosa.load(stem_path, sr=sr, mono=True)
     tempo, _ = librosa.beat.beat_track(y=audio_file, sr=sr)
-    tempo = float(tempo)
+    tempo = float(np.atleast_1d(tempo)[0])
 
     return tempo
 
@@ -68,6 +117,11 @@ def sound_class(stem_path, sr=22050):
     """
 
     y, sr = librosa.load(stem_path, sr=sr, mono=True)
+
+    return _sound_class(y)
+
+
+def _sound_class(y):
     harmonic, percussive = librosa.effects.hpss(y)
 
     harmonic_energy = np.sqrt(np.mean(np.square(harmonic)))
@@ -6,24 +6,43 @@
 
    dict_template
    feature_extraction
+   run_feature_extraction
    check_file_number
    save_stem_dataframe
+   read_index
+   write_index
+   stem_stats
+   load_manifest
+   save_manifest
+   update_index
    brid_track_info
    musdb_track_info
 """
 import argparse
 import glob
 import json
+import multiprocessing
 import os
 
-import pandas as pd
-import tqdm
+import lazy_loader as lazy
+import numpy as np
 
 from stem_mixer import features
 
+# imported on first use, see stem_mixer.mix
+pd = lazy.load("pandas")
+tqdm = lazy.load("tqdm")
+
 DEFAULT_SR = 44100
 BRID_INDEX = "brid_index.txt"
 MUSDB_INDEX = "musdb_index.txt"
+MANIFEST_FILE = "manifest.json"
+# bump whenever the extracted features change, so stems get reprocessed
+FEATURE_VERSION = 4
+# index columns stored as categoricals in binary index files
+CATEGORICAL_COLUMNS = ["sound_class", "instrument_name"]
+# index columns holding a list of values per stem
+LIST_COLUMNS = ["beat_times"]
 
 
 def dict_template(
@@ -74,7 +93,9 @@ def feature_extraction(data_home, stem_id, track_metadata=None, overwrite=False)
 
     Returns
     -------
-    None
+    metadata : dict
+        stem metadata, either computed or read from the existing JSON file.
+        a JSON file written by an older `FEATURE_VERSION` is recomputed.
     """
 
     stem_path = os.path.join(data_home, stem_id)
@@ -83,21 +104,112 @@ def feature_extraction(data_home, stem_id, track_metadata=None, overwrite=False)
     if track_metadata is None:
         track_metadata = dict_template()
 
-    if not os.path.exists(json_file_path) or overwrite:
+    metadata = None
+    if os.path.exists(json_file_path) and not overwrite:
+        with open(json_file_path, "r") as json_file:
+            metadata = json.load(json_file)
+        # files written before the current features miss some of them
+        if metadata.get("feature_version") != FEATURE_VERSION:
+            metadata = None
+
+    if metadata is None:
         metadata = track_metadata.copy()
+        metadata["feature_version"] = FEATURE_VERSION
+
+        # decode the stem once and keep the dataset-provided values
+        stem_features = features.extract(
+            stem_path, hpss=metadata["sound_class"] is None
+        )
 
         if metadata["tempo"] is None:
-            metadata["tempo"] = features.tempo(stem_path)
+            metadata["tempo"] = stem_features["tempo"]
 
         if metadata["sound_class"] is None:
-            metadata["sound_class"] = features.sound_class(stem_path)
+            metadata["sound_class"] = stem_features["sound_class"]
 
         metadata["tempo_bin"] = features.tempo_bin(metadata["tempo"])
+        for feature in [
+            "rms",
+            "beat_times",
+            "first_beat_time",
+            "trim_start",
+            "trim_end",
+            "native_sr",
+        ]:
+            metadata[feature] = stem_features[feature]
 
         with open(json_file_path, "w") as json_file:
             json.dump(metadata, json_file, indent=4)
 
-    return
+    return metadata
+
+
+def run_feature_extraction(tasks, jobs=1, description="Processing stems"):
+    r"""
+    Run `feature_extraction` over several stems, optionally in parallel.
+
+    Progress is reported in the order of `tasks`. A stem that fails does not
+    stop the others, its error is returned instead of its metadata.
+
+    Parameters
+    ----------
+    tasks : list[tuple]
+        list of ``(data_home, stem_id, track_metadata)``
+    jobs : int
+        number of worker processes. if 1 (default), stems are processed in
+        the current process.
+    description : str
+        progress bar description
+
+    Returns
+    -------
+    records : dict
+        stem_id -> metadata of the stems that were processed
+    errors : dict
+        stem_id -> error message of the stems that failed
+    """
+    records = {}
+    errors = {}
+
+    pbar = tqdm.tqdm(total=len(tasks))
+    pbar.set_description(description)
+
+    if jobs is None or jobs <= 1:
+        results = map(_feature_extraction_task, tasks)
+        for stem_id, metadata, error in results:
+            if error is not None:
+                errors[stem_id] = error
+            else:
+                records[stem_id] = metadata
+            pbar.update()
+    else:
+        chunksize = max(1, len(tasks) // (jobs * 8))
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.imap(_feature_extraction_task, tasks, chunksize)
+            for stem_id, metadata, error in results:
+                if error is not None:
+                    errors[stem_id] = error
+                else:
+                    records[stem_id] = metadata
+                pbar.update()
+
+    pbar.close()
+
+    for stem_id, error in errors.items():
+        print(f"Failed to process {stem_id}: {error}")
+
+    return records, errors
+
+
+def _feature_extraction_task(task):
+    data_home, stem_id, track_metadata = task
+
+    try:
+        metadata = feature_extraction(data_home, stem_id, track_metadata)
+    except Exception as e:
+        return stem_id, None, f"{type(e).__name__}: {e}"
+
+    return stem_id, metadata, None
 
 
 def check_file_number(json_files, wav_files):
@@ -125,7 +237,231 @@ def save_stem_dataframe(data_home, index_file="index.csv"):
             data.append(json.load(f))  # extracting json data
 
     df = pd.DataFrame.from_dict(data)
-    df.to_csv(os.path.join(data_home, index_file), index=False)
+    df = write_index(df, os.path.join(data_home, index_file))
+
+    return df
+
+
+def read_index(index_path):
+    r"""
+    Read a stem index. The format is chosen from the file extension:
+    ``.csv``, ``.parquet`` or ``.feather``.
+
+    Parquet and Feather files keep the index dtypes and are much faster to
+    load than CSV. They require ``pyarrow``.
+
+    Parameters
+    ----------
+    index_path : str
+        path to the index file
+
+    Returns
+    -------
+    df : pd.DataFrame
+        index with categorical ``sound_class`` / ``instrument_name``,
+        nullable integer ``tempo_bin`` and ``beat_times`` as arrays
+    """
+    extension = os.path.splitext(index_path)[1].lower()
+
+    if extension == ".parquet":
+        df = pd.read_parquet(index_path)
+    elif extension == ".feather":
+        df = pd.read_feather(index_path)
+    elif extension == ".csv":
+        df = pd.read_csv(index_path)
+        for column in LIST_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].map(
+                    lambda x: json.loads(x) if isinstance(x, str) else None
+                )
+    else:
+        raise ValueError(f"Unsupported index format: {index_path}")
+
+    df = _index_dtypes(df)
+    for column in LIST_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].map(
+                lambda x: None if x is None else np.asarray(x, dtype=float)
+            )
+
+    return df
+
+
+def write_index(df, index_path):
+    r"""
+    Write a stem index. The format is chosen from the file extension:
+    ``.csv``, ``.parquet`` or ``.feather``.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        stem index
+    index_path : str
+        path to the index file
+
+    Returns
+    -------
+    df : pd.DataFrame
+        index with the dtypes that were written
+    """
+    extension = os.path.splitext(index_path)[1].lower()
+    df = _index_dtypes(df)
+
+    # lists are stored natively in binary files and as JSON in CSV files
+    stored = df.copy()
+    for column in LIST_COLUMNS:
+        if column in stored.columns:
+            stored[column] = stored[column].map(_list_or_none)
+            if extension == ".csv":
+                stored[column] = stored[column].map(
+                    lambda x: None if x is None else json.dumps(x)
+                )
+
+    if extension == ".parquet":
+        stored.to_parquet(index_path, index=False)
+    elif extension == ".feather":
+        stored.to_feather(index_path)
+    elif extension == ".csv":
+        stored.to_csv(index_path, index=False)
+    else:
+        raise ValueError(f"Unsupported index format: {index_path}")
+
+    return df
+
+
+def _list_or_none(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [float(x) for x in value]
+    return None
+
+
+def _index_dtypes(df):
+    df = df.reset_index(drop=True)
+
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+
+    for column in ["tempo_bin", "native_sr"]:
+        if column in df.columns:
+            df[column] = df[column].astype("Int64")
+
+    return df
+
+
+def stem_stats(data_home):
+    r"""
+    Size and modification time of every stem in `data_home`
+
+    Parameters
+    ----------
+    data_home : str
+        path to folder with stems
+
+    Returns
+    -------
+    stats : dict
+        stem_id -> manifest entry with ``size``, ``mtime`` and
+        ``feature_version``
+    """
+    stats = {}
+    with os.scandir(data_home) as it:
+        for entry in it:
+            if not entry.name.endswith(".wav") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            stats[entry.name] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "feature_version": FEATURE_VERSION,
+            }
+
+    return stats
+
+
+def load_manifest(data_home):
+    r"""
+    Load the manifest of the stems that are already indexed
+
+    Parameters
+    ----------
+    data_home : str
+        path to folder with stems
+
+    Returns
+    -------
+    manifest : dict
+        stem_id -> manifest entry. empty if there is no manifest yet.
+    """
+    manifest_path = os.path.join(data_home, MANIFEST_FILE)
+
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(data_home, manifest):
+    r"""
+    Atomically write the manifest of the indexed stems
+
+    Parameters
+    ----------
+    data_home : str
+        path to folder with stems
+    manifest : dict
+        stem_id -> manifest entry
+    """
+    manifest_path = os.path.join(data_home, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+    return
+
+
+def update_index(data_home, records, removed, index_file="index.csv"):
+    r"""
+    Update the index in place instead of rebuilding it from the JSON files
+
+    Parameters
+    ----------
+    data_home : str
+        path to folder with stems
+    records : list[dict]
+        metadata of new or reprocessed stems
+    removed : set or None
+        stem ids whose rows must be dropped (deleted or reprocessed stems).
+        if None, the existing index is discarded.
+    index_file : str
+        index file name
+
+    Returns
+    -------
+    df : pd.DataFrame
+        updated index
+    """
+    index_path = os.path.join(data_home, index_file)
+
+    frames = []
+    if removed is not None and os.path.exists(index_path):
+        df = read_index(index_path)
+        removed = set(removed).union(r["stem_name"] for r in records)
+        frames.append(df[~df["stem_name"].isin(removed)])
+
+    if len(records) > 0:
+        frames.append(pd.DataFrame.from_dict(records))
+
+    # categoricals with different categories can't be concatenated
+    frames = [
+        frame.astype({c: object for c in CATEGORICAL_COLUMNS if c in frame.columns})
+        for frame in frames
+    ]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    df = write_index(df, index_path)
 
     return df
 
@@ -194,9 +530,25 @@ def brid_track_info(data_home, tid):
     return track_metadata
 
 
-def musdb(data_home):
-    """
+def musdb(data_home, jobs=1, stems=None):
+    r"""
     create metadata for MUSDB tracks present in `data_home`.
+
+    Parameters
+    ----------
+    data_home : str
+        path to folder with stems
+    jobs : int
+        number of worker processes
+    stems : set or None
+        if provided, only these stems are processed
+
+    Returns
+    -------
+    records : dict
+        stem_id -> metadata of the stems that were processed
+    errors : dict
+        stem_id -> error message of the stems that failed
     """
     musdb_stems = stems_from_file(MUSDB_INDEX)
 
@@ -207,15 +559,15 @@ def musdb(data_home):
 
     # process only what we have inside the stems folder
     available_stems = all_stems.intersection(musdb_stems)
+    if stems is not None:
+        available_stems = available_stems.intersection(stems)
 
-    pbar = tqdm.tqdm(available_stems)
-    pbar.set_description("Processing MUSDB stems")
+    tasks = [
+        (data_home, tid, musdb_track_info(data_home, tid))
+        for tid in sorted(available_stems)
+    ]
 
-    for tid in pbar:
-        track_metadata = musdb_track_info(data_home, tid)
-        feature_extraction(data_home, tid, track_metadata)
-
-    return
+    return run_feature_extraction(tasks, jobs, "Processing MUSDB stems")
 
 
 def musdb_track_info(data_home, tid):
@@ -267,9 +619,25 @@ def musdb_track_info(data_home, tid):
     return track_metadata
 
 
-def brid(data_home):
+def brid(data_home, jobs=1, stems=None):
     r"""
     create metadata for BRID tracks present in `data_home`.
+
+    Parameters
+    ----------
+    data_home : str
+        path to folder with stems
+    jobs : int
+        number of worker processes
+    stems : set or None
+        if provided, only these stems are processed
+
+    Returns
+    -------
+    records : dict
+        stem_id -> metadata of the stems that were processed
+    errors : dict
+        stem_id -> error message of the stems that failed
     """
     brid_stems = stems_from_file(BRID_INDEX)
 
@@ -280,15 +648,15 @@ def brid(data_home):
 
     # process only what we have inside the stems folder
     available_stems = all_stems.intersection(brid_stems)
+    if stems is not None:
+        available_stems = available_stems.intersection(stems)
 
-    pbar = tqdm.tqdm(available_stems)
-    pbar.set_description("Processing BRID stems")
-
-    for tid in pbar:
-        track_metadata = brid_track_info(data_home, tid)
-        feature_extraction(data_home, tid, track_metadata)
+    tasks = [
+        (data_home, tid, brid_track_info(data_home, tid))
+        for tid in sorted(available_stems)
+    ]
 
-    return
+    return run_feature_extraction(tasks, jobs, "Processing BRID stems")
 
 
 def stems_from_file(filename):
@@ -304,10 +672,15 @@ def stems_from_file(filename):
     return stems
 
 
-def process(data_home, datasets=None):
+def process(data_home, datasets=None, jobs=1, index_file="index.csv"):
     r"""
     generate metadata for all stems in the folder
 
+    The index is built incrementally: a manifest stores the size,
+    modification time and feature version of every indexed stem, so only
+    new or changed stems are processed and deleted stems are dropped from
+    the index.
+
     Parameters
     ----------
     data_home : str
@@ -317,21 +690,47 @@ def process(data_home, datasets=None):
         using the specific information we know, such as instruments and
         tempo.
         supported datasets are ["brid", "musdb"]
+    jobs : int
+        number of worker processes used for feature extraction
+    index_file : str
+        index file name. the extension selects the format, see `write_index`
 
     Returns
     -------
-    None
+    errors : dict
+        stem_id -> error message of the stems that failed
     """
-    # create a set with all stems (basename only)
-    available_stems = set(
-        [os.path.basename(tid) for tid in glob.glob(os.path.join(data_home, "*.wav"))]
+    stats = stem_stats(data_home)
+
+    manifest = load_manifest(data_home)
+    if not os.path.exists(os.path.join(data_home, index_file)):
+        manifest = {}
+    # without a manifest, the index is rebuilt from scratch
+    rebuild = len(manifest) == 0
+
+    deleted = set(manifest).difference(stats)
+    changed = set(
+        tid for tid in stats if tid in manifest and manifest[tid] != stats[tid]
     )
+    available_stems = set(stats).difference(manifest).union(changed)
+
+    # drop stale metadata so it gets recomputed
+    for tid in deleted.union(changed):
+        json_file_path = os.path.splitext(os.path.join(data_home, tid))[0] + ".json"
+        if os.path.exists(json_file_path):
+            os.remove(json_file_path)
+
+    to_process = available_stems.copy()
+    records = {}
+    errors = {}
 
-    all_stems = available_stems.copy()
+    def collect(result):
+        records.update(result[0])
+        errors.update(result[1])
 
     if datasets is not None and "brid" in datasets:
         # process tracks
-        brid(data_home)
+        collect(brid(data_home, jobs, stems=available_stems))
         # update stems list so we don't reprocess a brid stem
         brid_stems = set(stems_from_file(BRID_INDEX))
         available_stems = available_stems.difference(brid_stems)
@@ -340,19 +739,31 @@ def process(data_home, datasets=None):
         # process tracks
         musdb_stems = set(stems_from_file(MUSDB_INDEX))
         # update stems list so we don't reprocess a musdb stem
-        musdb(data_home)
+        collect(musdb(data_home, jobs, stems=available_stems))
         available_stems = available_stems.difference(musdb_stems)
 
     # process remaining stems
-    pbar = tqdm.tqdm(available_stems)
-    pbar.set_description("Processing remaining stems")
-    for tid in pbar:
-        track_metadata = dict_template(data_home, tid)
-        feature_extraction(data_home, tid, track_metadata=track_metadata)
+    tasks = [
+        (data_home, tid, dict_template(data_home, tid))
+        for tid in sorted(available_stems)
+    ]
+    collect(run_feature_extraction(tasks, jobs, "Processing remaining stems"))
 
     print("Writing stems dataframe")
-    save_stem_dataframe(data_home, index_file="index.csv")
-    return
+    update_index(
+        data_home,
+        [records[tid] for tid in sorted(records)],
+        None if rebuild else deleted.union(to_process),
+        index_file=index_file,
+    )
+
+    for tid in deleted.union(errors):
+        manifest.pop(tid, None)
+    for tid in records:
+        manifest[tid] = stats[tid]
+    save_manifest(data_home, manifest)
+
+    return errors
 
 
 if __name__ == "__main__":
@@ -369,10 +780,23 @@ if __name__ == "__main__":
         required=False,
         help="supported datasets: BRID (enter 'brid') and MUSDB (enter 'musdb')",
     )
+    parser.add_argument(
+        "--index_file",
+        required=False,
+        default="index.csv",
+        help="index file name. use a .parquet or .feather extension for a binary index",
+    )
+    parser.add_argument(
+        "--jobs",
+        required=False,
+        default=1,
+        type=int,
+        help="number of worker processes used for feature extraction",
+    )
 
     args = parser.parse_args()
 
     if args.datasets is not None:
         args.datasets = args.datasets.split(",")
 
-    process(args.data_home, args.datasets)
+    process(args.data_home, args.datasets, args.jobs, args.index_file)
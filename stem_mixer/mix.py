@@ -4,36 +4,315 @@
 .. autosummary::
    :toctree: generated/
 
+   StemSampler
    select_stems
    possible_tempo_bins
    time_stretch
+   time_stretch_batch
    align_first_beat
+   stack_stems
    mix
+   loudness
    generate_mixtures
+   iter_mixtures
+   warm_up
+   mixture_id
    save_mixture
 """
 import argparse
+import concurrent.futures
+import contextlib
+import functools
 import os
 import json
-import random
+import shutil
+import threading
 import uuid
 
+import lazy_loader as lazy
 import librosa
 import numpy as np
-import pandas as pd
 import soundfile as sf
-import tqdm
+
+from stem_mixer import audio, metadata
+from stem_mixer.cache import AudioCache
+from stem_mixer.pipeline import Stage, run_stages
+from stem_mixer.profiling import Profiler, timed
+from stem_mixer.runs import RunManifest
+from stem_mixer.store import StemStore
+from stem_mixer.writers import ShardWriter
+
+# imported on first use, so the CLI and worker processes that never need
+# them start faster. librosa already loads its submodules lazily
+pd = lazy.load("pandas")
+tqdm = lazy.load("tqdm")
+
+# tempo ratios between the base stem and the other stems of a mixture
+TEMPO_OCTAVES = [0.5, 1, 2, 4]
+
+# largest deviation of the stretch rate from 1.0 that the "hybrid" backend
+# handles by resampling. 0.06 shifts the pitch by about one semitone
+RESAMPLE_MAX_DEVIATION = 0.06
+
+
+class StemSampler:
+    r"""
+    In-memory index of stems used to draw the stems of each mixture.
+
+    The index is parsed once and the tempo bins that can hold a given
+    combination of harmonic and percussive stems are computed only the
+    first time that combination is requested.
+
+    Rows are grouped by ``(tempo_bin, sound_class, instrument_name)`` into
+    integer position arrays, so drawing stems only touches the groups of the
+    requested tempo octaves instead of filtering the whole dataframe.
+
+    Parameters
+    ----------
+    index : pd.DataFrame
+        dataframe with stems information
+
+    Attributes
+    ----------
+    index : pd.DataFrame
+        dataframe with stems information
+    missing_beat_times : bool
+        True if some stems have no beat grid in the index, so their first
+        beat is found with beat tracking
+    """
+
+    def __init__(self, index):
+        if "instrument_name" not in index.columns:
+            index = index.assign(instrument_name=None)
+
+        self.index = index.reset_index(drop=True)
+        self._tempo_choices = {}
+
+        self._records = self.index.to_dict("records")
+        self.missing_beat_times = any(
+            not isinstance(r.get("beat_times"), (list, np.ndarray))
+            for r in self._records
+        )
+        self._positions = {
+            name: i for i, name in enumerate(self.index["stem_name"])
+        }
+
+        # (tempo_bin, sound_class) -> list of (instrument_name, rows)
+        self._groups = {}
+        # position of each row inside its group
+        self._group_position = np.zeros(len(self.index), dtype=int)
+
+        grouped = self.index.groupby(
+            ["tempo_bin", "sound_class", "instrument_name"],
+            dropna=False,
+            sort=False,
+            observed=True,
+        ).indices
+
+        for (tempo_bin, sound_class, instrument_name), rows in grouped.items():
+            if pd.isna(tempo_bin) or pd.isna(sound_class):
+                continue
+
+            self._groups.setdefault((tempo_bin, sound_class), []).append(
+                (instrument_name, rows)
+            )
+            self._group_position[rows] = np.arange(len(rows))
+
+    @classmethod
+    def from_file(cls, data_home, index_file="index.csv"):
+        r"""
+        Load a sampler from an index file
+
+        Parameters
+        ----------
+        data_home : str
+            path to stems
+        index_file : str
+            index file with pre-computed features (.csv, .parquet or .feather)
+
+        Returns
+        -------
+        sampler : StemSampler
+        """
+        return cls(metadata.read_index(os.path.join(data_home, index_file)))
+
+    def tempo_choices(self, n_harmonic, n_percussive):
+        r"""
+        Cached version of `possible_tempo_bins` for this index
+
+        Parameters
+        ----------
+        n_harmonic : int
+            number of harmonic stems for a given mixture
+        n_percussive : int
+            number of percussive stems for a given mixture
+
+        Returns
+        -------
+        possible_tempo : list
+            list with tempo_bins that have at least n_harmonic and
+            n_percussive tracks
+        """
+        return list(self._base_instruments(n_harmonic, n_percussive))
+
+    def _base_instruments(self, n_harmonic, n_percussive):
+        # cached _base_instruments of the index
+        key = (n_harmonic, n_percussive)
+        if key not in self._tempo_choices:
+            self._tempo_choices[key] = _base_instruments(
+                self.index, n_harmonic, n_percussive
+            )
+
+        return self._tempo_choices[key]
+
+    def sample(self, n_percussive, n_harmonic, base_stem=None, rng=None):
+        r"""
+        Select stems for a single mixture
+
+        Parameters
+        ----------
+        n_percussive : int
+            number of percussive stems
+        n_harmonic : int
+            number of harmonic stems
+        base_stem : str or None
+            name of the stem the mixture is built around. random if None.
+        rng : np.random.Generator or None
+            random generator used for every draw. a fresh unseeded
+            generator if None.
+
+        Returns
+        -------
+        stems : list[dict]
+            list with stems that will be used for mixture
+        base_tempo : int
+            tempo_bin from the base stem
+        """
+        rng = np.random.default_rng(rng)
+        base_instruments = self._base_instruments(n_harmonic, n_percussive)
+        if len(base_instruments) == 0:
+            raise ValueError(
+                f"No tempo bin has enough stems for {n_harmonic} harmonic and "
+                f"{n_percussive} percussive stems of different instruments"
+            )
+        tempo_choices = list(base_instruments)
+
+        tempo = tempo_choices[rng.integers(len(tempo_choices))]
+
+        # base_stem for now is random if not provided. it is drawn among the
+        # instruments leaving enough stems of other instruments
+        if base_stem is not None:
+            base_row = self._positions[base_stem]
+        elif n_percussive > 0:
+            n_percussive -= 1
+            groups = self._candidates(
+                [tempo], "percussive", instruments=base_instruments[tempo]
+            )
+            base_row = self._sample_rows(groups, 1, rng)[0]
+        elif n_harmonic > 0:
+            n_harmonic -= 1
+            groups = self._candidates(
+                [tempo], "harmonic", instruments=base_instruments[tempo]
+            )
+            base_row = self._sample_rows(groups, 1, rng)[0]
+
+        base_stem = dict(self._records[base_row])
+        base_tempo = base_stem["tempo_bin"]
+        tempo_octaves = [int(i * base_tempo) for i in TEMPO_OCTAVES]
+        base_instrument = base_stem["instrument_name"]
+
+        # TODO: what to do with undetermined stems?
+        # sample percussive stems
+        percussive = []
+        if n_percussive > 0:
+            groups = self._candidates(tempo_octaves, "percussive", base_instrument)
+            rows = self._sample_rows(groups, n_percussive, rng, exclude=base_row)
+            percussive = [dict(self._records[r]) for r in rows]
+
+        # sample harmonic stems
+        harmonic = []
+        if n_harmonic > 0:
+            groups = self._candidates(tempo_octaves, "harmonic", base_instrument)
+            rows = self._sample_rows(groups, n_harmonic, rng, exclude=base_row)
+            harmonic = [dict(self._records[r]) for r in rows]
+
+        # combine everything into single list
+        stems = [base_stem] + percussive + harmonic
+        return stems, base_tempo
+
+    def _candidates(
+        self, tempo_bins, sound_class, exclude_instrument=None, instruments=None
+    ):
+        # groups of rows in `tempo_bins` with `sound_class`, restricted to
+        # `instruments` if provided. stems without an instrument name are
+        # never considered the same instrument
+        candidates = []
+        for tempo_bin in tempo_bins:
+            for instrument_name, rows in self._groups.get((tempo_bin, sound_class), []):
+                if (
+                    not pd.isna(exclude_instrument)
+                    and instrument_name == exclude_instrument
+                ):
+                    continue
+                if (
+                    instruments is not None
+                    and _instrument_key(instrument_name) not in instruments
+                ):
+                    continue
+                candidates.append(rows)
+
+        return candidates
+
+    def _sample_rows(self, groups, n, rng, exclude=None):
+        # draw `n` distinct rows from the concatenation of `groups` without
+        # building it: positions are drawn first and mapped back to groups
+        ends = np.cumsum([len(rows) for rows in groups])
+        total = int(ends[-1]) if len(groups) > 0 else 0
+
+        skip = None
+        if exclude is not None:
+            for rows, end in zip(groups, ends):
+                start = end - len(rows)
+                position = self._group_position[exclude]
+                if position < len(rows) and rows[position] == exclude:
+                    skip = start + position
+                    total -= 1
+                    break
+
+        positions = rng.choice(total, n, replace=False)
+        if skip is not None:
+            positions[positions >= skip] += 1
+
+        group_ids = np.searchsorted(ends, positions, side="right")
+        starts = ends[group_ids] - [len(groups[g]) for g in group_ids]
+
+        return [
+            int(groups[g][p - start]) for g, p, start in zip(group_ids, positions, starts)
+        ]
 
 
 def select_stems(
-    n_percussive, n_harmonic, data_home, index_file, base_stem=None, **kwargs
+    n_percussive, n_harmonic, data_home, index_file, base_stem=None, sampler=None,
+    rng=None, **kwargs
 ):
-    """
+    r"""
     Select stems from a given index
 
     Parameters
     -----------
+    n_percussive : int
+        number of percussive stems
+    n_harmonic : int
+        number of harmonic stems
+    data_home : str
+        path to stems
+    index_file : str
+        index file with pre-computed features
     base_stem : str
+    sampler : StemSampler or None
+        pre-loaded index. if None, `index_file` is read from `data_home`.
+    rng : np.random.Generator or None
+        random generator used for every draw
     \*\*kwargs : dict additional arguments
 
     Returns
@@ -45,61 +324,10 @@ def select_stems(
     base_tempo : int
         tempo_bin from the base stem
     """
-    index = pd.read_csv(os.path.join(data_home, index_file))
-    tempo_choices = possible_tempo_bins(index, n_harmonic, n_percussive)
-
-    # print(tempo_choices)
-    tempo = random.choice(tempo_choices)
-    # print(tempo_choices, tempo)
-
-    # base_stem for now is random if not provided
-    if base_stem is not None:
-        base_stem = index[index["stem_name"] == base_stem]
-    elif n_percussive > 0:
-        n_percussive -= 1
-        base_stem = index[
-            (index["sound_class"] == "percussive") & (index["tempo_bin"] == tempo)
-        ].sample()
-    elif n_harmonic > 0:
-        n_harmonic -= 1
-        base_stem = index[
-            (index["sound_class"] == "harmonic") & (index["tempo_bin"] == tempo)
-        ].sample()
-
-    # remove base_stem from index so we don't use it twice
-    index = index.drop(base_stem.index)
-
-    base_stem = base_stem.to_dict("records")[0]
-    base_tempo = base_stem["tempo_bin"]
-    tempo_octaves = [int(i * base_tempo) for i in [0.5, 1, 2, 4]]
-
-    index_filtered = index[
-        (index["tempo_bin"].isin(tempo_octaves))
-        & (index["instrument_name"] != base_stem["instrument_name"])
-    ]
-
-    # TODO: add instrument check
-
-    # TODO: what to do with undetermined stems?
-    # sample percussive stems
-    percussive = []
-    if n_percussive > 0:
-        percussive_index = index_filtered[index_filtered["sound_class"] == "percussive"]
-        # if len(percussive_index) < n_percussive:
-        #     print("no percussive tracks left on this tempo bin!")
-        percussive = percussive_index.sample(n_percussive).to_dict("records")
-
-    # sample harmonic stems
-    harmonic = []
-    if n_harmonic > 0:
-        harmonic_index = index_filtered[index_filtered["sound_class"] == "harmonic"]
-        # if len(harmonic_index) < n_harmonic:
-        #     print("no harmonic tracks left on this tempo bin!")
-        harmonic = harmonic_index.sample(n_harmonic).to_dict("records")
+    if sampler is None:
+        sampler = StemSampler.from_file(data_home, index_file)
 
-    # combine everything into single list
-    stems = [base_stem] + percussive + harmonic
-    return stems, base_tempo
+    return sampler.sample(n_percussive, n_harmonic, base_stem=base_stem, rng=rng)
 
 
 def possible_tempo_bins(index, n_harmonic, n_percussive):
@@ -107,6 +335,12 @@ def possible_tempo_bins(index, n_harmonic, n_percussive):
     return all possible tempo_bins that can be used for the provided n_harmonic and
     n_percussive
 
+    A tempo bin is possible if it has a stem of the base stem class
+    (percussive if ``n_percussive > 0``, harmonic otherwise) such that the
+    bin together with its octaves (see `TEMPO_OCTAVES`), which is where
+    `select_stems` draws from, has at least n_harmonic and n_percussive
+    stems of instruments other than the base stem instrument.
+
     Parameters
     ----------
     index : pd.DataFrame
@@ -122,63 +356,515 @@ def possible_tempo_bins(index, n_harmonic, n_percussive):
         list with tempo_bins that have at least n_harmonic and n_percussive
         tracks
     """
+    return list(_base_instruments(index, n_harmonic, n_percussive))
+
+
+def _base_instruments(index, n_harmonic, n_percussive):
+    # possible tempo bins -> instruments of the base stems a mixture can be
+    # built around in that bin (None for stems without instrument name)
+    index = index[index["tempo_bin"].notna()]
+    if "instrument_name" in index.columns:
+        codes, instruments = pd.factorize(index["instrument_name"])
+    else:
+        codes, instruments = np.full(len(index), -1), pd.Index([])
+
+    # (tempo_bin, instrument code) x sound_class count table
+    counts = pd.crosstab(
+        [index["tempo_bin"].astype(int).to_numpy(), codes], index["sound_class"]
+    ).reindex(columns=["harmonic", "percussive"], fill_value=0)
+    tempo_bins = counts.index.get_level_values(0).to_numpy()
+    instrument_codes = counts.index.get_level_values(1).to_numpy()
+    totals = counts.groupby(level=0).sum()
+
+    # stems of the bin and its octaves: all of them, and those of the same
+    # instrument, which are never drawn with a base stem of that instrument
+    octave_counts = np.zeros(counts.shape, dtype=int)
+    same_instrument = np.zeros(counts.shape, dtype=int)
+    for factor in TEMPO_OCTAVES:
+        octave_bins = (tempo_bins * factor).astype(int)
+        octave_counts += totals.reindex(octave_bins, fill_value=0).to_numpy()
+        same_instrument += counts.reindex(
+            pd.MultiIndex.from_arrays([octave_bins, instrument_codes]), fill_value=0
+        ).to_numpy()
+    # stems without instrument name only exclude the base stem itself
+    named = instrument_codes >= 0
+    same_instrument[~named] = 0
+    available = octave_counts - same_instrument
+
+    base_class = 1 if n_percussive > 0 else 0
+    needed = np.array([n_harmonic, n_percussive])[None, :].repeat(len(counts), 0)
+    # the base stem is one of the stems of its class and, for named
+    # instruments, is not part of the available stems
+    needed[named, base_class] -= 1
+    possible = (counts.to_numpy()[:, base_class] > 0) & np.all(
+        available >= needed, axis=1
+    )
 
-    all_tempo_bins = index["tempo_bin"].unique()
-    tempo_bin_count = index[["tempo_bin", "sound_class"]].value_counts()
-
-    possible_tempo = []
-
-    for tempo in all_tempo_bins:
-        # hmmmm i'm not sure about this try/except blocks but i didnt find
-        # anything better for now
-        try:
-            qty_harmonic = tempo_bin_count[(tempo, "harmonic")]
-        except KeyError:
-            qty_harmonic = 0
+    base_instruments = {}
+    for tempo_bin, code in zip(tempo_bins[possible], instrument_codes[possible]):
+        instrument = None if code < 0 else instruments[code]
+        base_instruments.setdefault(int(tempo_bin), set()).add(instrument)
 
-        try:
-            qty_percussive = tempo_bin_count[(tempo, "percussive")]
-        except KeyError:
-            qty_percussive = 0
+    return dict(sorted(base_instruments.items()))
 
-        if qty_harmonic >= n_harmonic and qty_percussive >= n_percussive:
-            possible_tempo.append(tempo)
 
-    return possible_tempo
+def _instrument_key(instrument_name):
+    # instrument name as stored by _base_instruments
+    return None if pd.isna(instrument_name) else instrument_name
 
 
-def time_stretch(stems, base_tempo, duration=10.0, sr=22050):
+def time_stretch(
+    stems,
+    base_tempo,
+    duration=10.0,
+    sr=22050,
+    cache=None,
+    random_offset=False,
+    rng=None,
+    backend="phase_vocoder",
+    tolerance=None,
+    batch=False,
+    store=None,
+):
     r"""
     Receive a base_tempo and stretch select stems to match it.
 
+    Only the part of the stem needed to fill `duration` once stretched is
+    read. If the stem has precomputed trim boundaries (``trim_start`` and
+    ``trim_end``), reading starts at its first non-silent sample (or at a
+    random point between the trim boundaries) instead of trimming here.
+
     Parameters
     ----------
     stems : list[dict]
     base_tempo : float
+    duration : float
+        mixture duration
+    sr : int
+        sample rate
+    cache : AudioCache or None
+        if provided, stretched audio is read from / written to this cache
+    random_offset : bool
+        if True, start reading stems with known trim boundaries at a random
+        point, so long stems contribute different excerpts to each mixture
+    rng : np.random.Generator or None
+        random generator used for the random offsets
+    backend : str
+        name of the stretch function in `STRETCH_BACKENDS`:
+
+        - ``"phase_vocoder"``: ``librosa.effects.time_stretch``
+          (default). keeps the pitch.
+        - ``"resample"``: resamples the stem, which is much faster but
+          shifts its pitch along with its tempo.
+        - ``"hybrid"``: resamples when the rate is within
+          `RESAMPLE_MAX_DEVIATION` of 1.0, where the pitch shift is small,
+          and uses the phase vocoder otherwise.
+    tolerance : float or None
+        stems whose stretch rate is within `tolerance` of 1.0 or of an
+        octave of the base tempo (see `TEMPO_OCTAVES`) are not stretched:
+        their beats already fall on the beats of the mixture. if None,
+        every stem is stretched.
+    batch : bool
+        if True, the stems stretched by the ``"phase_vocoder"`` backend are
+        stretched together by `time_stretch_batch`, which is faster but not
+        bit-identical to ``librosa.effects.time_stretch``.
+    store : StemStore or None
+        if provided, stems packed in the store are sliced from it instead
+        of being decoded
 
     Returns
     -------
     stems
+        stems with ``stretched_audio``, ``stretch_rate`` and
+        ``segment_start``, the time in the original stem where the stretched
+        audio begins (None if unknown).
     """
 
+    reads = _plan_reads(
+        stems,
+        base_tempo,
+        duration,
+        random_offset=random_offset,
+        rng=rng,
+        backend=backend,
+        tolerance=tolerance,
+    )
+
+    ys = [
+        _load_stem(s, read, sr=sr, cache=cache, store=store)
+        for s, read in zip(stems, reads)
+    ]
+    if batch:
+        _stretch_stems(stems, reads, ys, sr=sr, cache=cache)
+    else:
+        for s, read, y in zip(stems, reads, ys):
+            _stretch_stem(s, read, y, sr=sr, cache=cache)
+
+    return stems
+
+
+def _plan_reads(
+    stems,
+    base_tempo,
+    duration,
+    random_offset=False,
+    rng=None,
+    backend="phase_vocoder",
+    tolerance=None,
+):
+    # decides which window of every stem is read. returns one dict per stem
+    # with the audio path, offset and duration of the window, and sets the
+    # stretch_rate of the stems
+    if random_offset:
+        rng = np.random.default_rng(rng)
+
+    reads = []
     for s in stems:
         stem_tempo = s["tempo"]
 
         audio_path = os.path.join(s["data_home"], s["stem_name"])
-        # removing silences at beginning and ending
-        audio, sr = librosa.load(audio_path, sr=sr, duration=duration * 2)
-        audio, _ = librosa.effects.trim(audio)
+        new_tempo = _stretch_rate(base_tempo / stem_tempo, tolerance)
+        s["stretch_rate"] = new_tempo
+
+        trim_start = s.get("trim_start")
+        trim_end = s.get("trim_end")
+        if trim_start is None or pd.isna(trim_start):
+            trim_start = None
+        if trim_end is None or pd.isna(trim_end):
+            trim_end = None
+
+        # input needed to fill the mixture once stretched, plus one beat
+        # of margin for the first beat alignment
+        window = duration * new_tempo + 60.0 / stem_tempo
+
+        if trim_start is not None:
+            offset = trim_start
+            if trim_end is not None:
+                available = trim_end - trim_start
+                if random_offset and available > window:
+                    offset += rng.uniform(0, available - window)
+                window = min(window, trim_end - offset)
+        else:
+            # leading silence is only found after reading, so read extra audio
+            offset = 0.0
+            window = max(window, duration * 2)
+
+        reads.append(
+            {
+                "path": audio_path,
+                "offset": offset,
+                "duration": window,
+                "rate": new_tempo,
+                "backend": backend,
+                "trimmed": trim_start is not None,
+                "key": None,
+            }
+        )
+
+    return reads
+
+
+def _load_stem(s, read, sr=22050, cache=None, store=None):
+    # reads the stretched stem from the cache, or the raw window to stretch
+    # from the store or the audio file
+    read["packed"] = store is not None and store.contains(s, sr=sr)
+
+    if cache is not None:
+        # packed audio is resampled as a whole, not per window, so it is
+        # cached apart from decoded audio
+        packed = {"packed": True} if read["packed"] else {}
+        read["key"] = cache.key(
+            read["path"],
+            sr=sr,
+            offset=read["offset"],
+            duration=read["duration"],
+            rate=read["rate"],
+            backend=read["backend"],
+            trimmed=read["trimmed"],
+            **packed,
+        )
+        stretched_audio = cache.get(read["key"])
+        if stretched_audio is not None:
+            read["cached"] = True
+            return stretched_audio
 
-        new_tempo = base_tempo / stem_tempo
-        s["stretched_audio"] = librosa.effects.time_stretch(audio, rate=new_tempo)
+    read["cached"] = False
+    if read["packed"]:
+        return store.get(s, sr=sr, offset=read["offset"], duration=read["duration"])
 
-    return stems
+    y, _ = audio.load(
+        read["path"], sr=sr, offset=read["offset"], duration=read["duration"]
+    )
+
+    return y
+
+
+def _slice_packed(job, sr=22050, cache=None, store=None):
+    # reads the packed stems skipped by _decode_mixture. runs in the process
+    # stretching the stems, so the audio is sliced from the memory map of
+    # that process instead of being copied from the process decoding stems
+    for i, (s, read) in enumerate(zip(job["stems"], job["reads"])):
+        if job["audio"][i] is not None:
+            continue
+
+        with timed(job["events"], "load", stem=s["stem_name"], packed=True) as event:
+            y = _load_stem(s, read, sr=sr, cache=cache, store=store)
+            event.update(samples=len(y), bytes=0, cache_hit=read["cached"])
+        job["audio"][i] = y
+
+    return job
+
+
+def _stretch_stems(stems, reads, ys, sr=22050, cache=None):
+    # stretches all the stems of a mixture. stems stretched by the phase
+    # vocoder are stretched together by time_stretch_batch
+    batch = []
+    for s, read, y in zip(stems, reads, ys):
+        if read["cached"] or read["rate"] == 1.0 or read["backend"] != "phase_vocoder":
+            _stretch_stem(s, read, y, sr=sr, cache=cache)
+        else:
+            batch.append((s, read, _trim_stem(s, read, y, sr=sr)))
+
+    if not batch:
+        return
+
+    stretched = time_stretch_batch(
+        [y for _, _, y in batch], [read["rate"] for _, read, _ in batch]
+    )
+    for (s, read, _), y in zip(batch, stretched):
+        s["stretched_audio"] = y
+        if cache is not None:
+            cache.put(read["key"], y)
+
+    return
+
+
+def _trim_stem(s, read, y, sr=22050):
+    # sets segment_start and removes the leading silence of stems without
+    # trim boundaries
+    if read["trimmed"]:
+        s["segment_start"] = read["offset"]
+        return y
+
+    # removing silences at beginning and ending
+    y, (start, _) = librosa.effects.trim(y)
+    s["segment_start"] = start / sr
+
+    return y
+
+
+def _stretch_stem(s, read, y, sr=22050, cache=None):
+    # sets stretched_audio and segment_start of a stem from the output of
+    # _load_stem
+    if read["cached"]:
+        s["stretched_audio"] = y
+        s["segment_start"] = read["offset"] if read["trimmed"] else None
+        return
+
+    y = _trim_stem(s, read, y, sr=sr)
+
+    if read["rate"] == 1.0:
+        s["stretched_audio"] = y
+    else:
+        stretch = STRETCH_BACKENDS[read["backend"]]
+        s["stretched_audio"] = stretch(y, read["rate"], sr)
+
+    if cache is not None:
+        cache.put(read["key"], s["stretched_audio"])
+
+    return
+
+
+def _stretch_rate(rate, tolerance=None):
+    # rates close enough to an octave of the base tempo are not stretched
+    if tolerance is not None:
+        for octave in TEMPO_OCTAVES:
+            if abs(rate * octave - 1.0) <= tolerance:
+                return 1.0
+
+    return rate
+
+
+def _phase_vocoder(y, rate, sr):
+    return librosa.effects.time_stretch(y, rate=rate)
+
+
+def _resample(y, rate, sr):
+    # playing the stem faster changes its tempo and pitch by the same ratio
+    stretched = librosa.resample(y, orig_sr=sr * rate, target_sr=sr)
+    return stretched.astype(np.float32, copy=False)
+
+
+def _hybrid(y, rate, sr):
+    if abs(rate - 1.0) <= RESAMPLE_MAX_DEVIATION:
+        return _resample(y, rate, sr)
+    return _phase_vocoder(y, rate, sr)
+
+
+# name -> function(y, rate, sr) returning y played `rate` times faster.
+# other backends can be registered here
+STRETCH_BACKENDS = {
+    "phase_vocoder": _phase_vocoder,
+    "resample": _resample,
+    "hybrid": _hybrid,
+}
+
+
+def time_stretch_batch(ys, rates, n_fft=2048, hop_length=512):
+    r"""
+    Time stretch several signals at once with a phase vocoder
+
+    The signals are zero padded into a single 2-D array so their STFT runs
+    in one call, and the phase vocoder computes the phase advance of all
+    the frames of a signal at once instead of frame by frame. The inverse
+    STFT runs per signal: librosa's overlap-add is slower on a batch than
+    on its rows. The work arrays are kept between calls (one set per
+    thread) and only grow when a larger batch comes in.
+
+    The result matches ``librosa.effects.time_stretch`` up to the rounding
+    of the accumulated phase, which is kept smaller here.
+
+    Parameters
+    ----------
+    ys : list[np.ndarray]
+        mono signals. they can have different lengths.
+    rates : list[float]
+        stretch rate of every signal. rates above 1 speed the signal up.
+    n_fft : int
+        FFT size
+    hop_length : int
+        number of samples between STFT frames
+
+    Returns
+    -------
+    stretched : list[np.ndarray]
+        float32 signals, of length ``round(len(y) / rate)``
+    """
+    n_signals = len(ys)
+    n_samples = max(len(y) for y in ys)
+    n_bins = 1 + n_fft // 2
+    n_frames = 1 + n_samples // hop_length
+
+    y_batch = _work_array("y", (n_signals, n_samples), np.float32)
+    for row, y in zip(y_batch, ys):
+        row[: len(y)] = y
+        row[len(y):] = 0.0
+
+    stft = librosa.stft(
+        y_batch,
+        n_fft=n_fft,
+        hop_length=hop_length,
+        out=_work_array("stft", (n_signals, n_bins, n_frames), np.complex64),
+    )
+
+    lengths = [int(round(len(y) / rate)) for y, rate in zip(ys, rates)]
+    frames = [
+        int(np.ceil((1 + len(y) // hop_length) / rate)) for y, rate in zip(ys, rates)
+    ]
+    stretched = _work_array(
+        "stretched", (n_signals, n_bins, max(frames)), np.complex64
+    )
+    # frequency of every bin in radians per hop
+    phase_advance = np.linspace(0, np.pi * hop_length, n_bins)
+
+    for i, (y, rate) in enumerate(zip(ys, rates)):
+        # frames of the signal itself, without the padding of the batch
+        signal_frames = 1 + len(y) // hop_length
+        _phase_vocoder_frames(
+            stft[i, :, :signal_frames], rate, phase_advance, stretched[i, :, : frames[i]]
+        )
+
+    # istft allocates its output, so nothing refers to the work arrays
+    return [
+        librosa.istft(
+            stretched[i, :, : frames[i]],
+            n_fft=n_fft,
+            hop_length=hop_length,
+            length=lengths[i],
+        )
+        for i in range(n_signals)
+    ]
+
+
+def _phase_vocoder_frames(stft, rate, phase_advance, out):
+    # same as librosa.phase_vocoder, vectorized over the output frames: the
+    # phase is accumulated by a cumsum instead of a python loop
+    n_bins, n_frames = stft.shape
+    time_steps = np.arange(0, n_frames, rate)
+    columns = time_steps.astype(np.intp)
+    alpha = (time_steps - columns).astype(np.float32)
+
+    # two frames of zeros, as the interpolation reads one frame ahead
+    magnitude = _work_array("magnitude", (n_bins, n_frames + 2), np.float32)
+    angle = _work_array("angle", (n_bins, n_frames + 2), np.float32)
+    np.abs(stft, out=magnitude[:, :n_frames])
+    angle[:, :n_frames] = np.angle(stft)
+    magnitude[:, n_frames:] = 0.0
+    angle[:, n_frames:] = 0.0
+
+    # magnitude interpolated between the two closest frames
+    out_magnitude = magnitude[:, columns]
+    next_magnitude = magnitude[:, columns + 1]
+    next_magnitude -= out_magnitude
+    next_magnitude *= alpha
+    out_magnitude += next_magnitude
+
+    # phase difference between consecutive frames, minus the expected
+    # advance of every bin, wrapped to [-pi, pi]
+    dphase = angle[:, columns + 1]
+    dphase -= angle[:, columns]
+    dphase -= phase_advance[:, None]
+    dphase -= np.float32(2 * np.pi) * np.round(dphase / np.float32(2 * np.pi))
+    # the advance is added back modulo 2 pi, which keeps the accumulated
+    # phase small and precise in float32
+    dphase += np.mod(phase_advance, 2 * np.pi).astype(np.float32)[:, None]
+
+    phase = np.empty_like(dphase)
+    phase[:, 0] = angle[:, 0]
+    np.cumsum(dphase[:, :-1], axis=1, out=phase[:, 1:])
+    phase[:, 1:] += angle[:, :1]
+
+    # out = magnitude * exp(1j * phase), reusing dphase as a buffer
+    np.cos(phase, out=dphase)
+    dphase *= out_magnitude
+    out.real = dphase
+    np.sin(phase, out=dphase)
+    dphase *= out_magnitude
+    out.imag = dphase
+
+    return out
+
+
+# work arrays of time_stretch_batch, per thread
+_work_arrays = threading.local()
+
+
+def _work_array(name, shape, dtype):
+    # view of shape `shape` on a cached array, reallocated only when it is
+    # too small
+    arrays = _work_arrays.__dict__
+    array = arrays.get(name)
+    if (
+        array is None
+        or array.dtype != dtype
+        or any(have < need for have, need in zip(array.shape, shape))
+    ):
+        capacity = shape if array is None else np.maximum(array.shape, shape)
+        array = np.empty(tuple(capacity), dtype=dtype)
+        arrays[name] = array
+
+    return array[tuple(slice(0, n) for n in shape)]
 
 
 def align_first_beat(stems, sr=22050):
     r"""
     Zero pad stems so their first beat is aligned.
 
+    The first beat is derived from the beat grid computed during indexing
+    (``beat_times``) when available: it is the first beat after the
+    beginning of the stretched audio, divided by the stretch rate. Otherwise
+    the stretched audio goes through beat tracking.
+
     Parameters
     ----------
     stems : list(dict)
@@ -195,9 +881,7 @@ def align_first_beat(stems, sr=22050):
     latest_beat_time = 0
 
     for s in aligned_stems:
-        _, beat_frames = librosa.beat.beat_track(y=s["stretched_audio"], sr=sr)
-        beat_times = librosa.frames_to_time(beat_frames, sr=sr)
-        s["first_beat_time"] = beat_times[0]
+        s["first_beat_time"] = _first_beat_time(s, sr)
 
         if s["first_beat_time"] > latest_beat_time:
             latest_beat_time = s["first_beat_time"]
@@ -215,13 +899,77 @@ def align_first_beat(stems, sr=22050):
     return aligned_stems
 
 
-def mix(duration, stems, strategy="zeros", sr=22050):
+def _first_beat_time(stem, sr):
+    beat_times = stem.get("beat_times")
+    segment_start = stem.get("segment_start")
+
+    if isinstance(beat_times, (list, np.ndarray)) and segment_start is not None:
+        beat_times = np.asarray(beat_times)
+        beat_times = beat_times[beat_times >= segment_start]
+
+        if len(beat_times) > 0:
+            return float((beat_times[0] - segment_start) / stem["stretch_rate"])
+
+    _, beat_frames = librosa.beat.beat_track(y=stem["stretched_audio"], sr=sr)
+    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+
+    return beat_times[0]
+
+
+def stack_stems(duration, stems, strategy="zeros", sr=22050):
+    r"""
+    Write the stems into a single preallocated (n_stems, n_samples) matrix.
+
+    Parameters
+    ----------
+    duration : float
+        desired duration
+    stems : list[dict]
+        list with stems we're combining
+    strategy : str
+        strategy to deal with stems shorter than desired mixture duration.
+        * zeros: add silence to the end of the stem (default)
+        * cut: cut all stems to minimum length
+        * repeat: repeat stem and cut it to match mixture duration
+    sr : int
+        sample rate
+
+    Returns
+    -------
+    stem_matrix : np.ndarray
+        float32 matrix with one stem per row
+    """
+    if strategy not in ["zeros", "cut", "repeat"]:
+        raise ValueError(f"Unknown strategy: {strategy}")
+
+    n_samples = int(duration * sr)
+    if strategy == "cut":
+        n_samples = min([n_samples] + [len(s["audio"]) for s in stems])
+
+    stem_matrix = np.zeros((len(stems), n_samples), dtype=np.float32)
+
+    for i, s in enumerate(stems):
+        length = min(len(s["audio"]), n_samples)
+        stem_matrix[i, :length] = s["audio"][:length]
+
+        if strategy == "repeat" and length > 0:
+            # tile the row onto itself, doubling the filled part each time
+            while length < n_samples:
+                size = min(length, n_samples - length)
+                stem_matrix[i, length:length + size] = stem_matrix[i, :size]
+                length += size
+
+    return stem_matrix
+
+
+def mix(duration, stems, strategy="zeros", sr=22050, return_matrix=False):
     r"""
-    Receives final processed
-    audios and cuts them all to the length of the shortest audio to ensure there will be no
-    silence. Creates a list of the truncated stems and cuts them again to fit desired duration>
-    Then adds stems together to create mixture and also writes off each stem as a sound file to
-    uuid output folder. This writing process ONLY occurs if mixture is valid, final check in place.
+    Receives final processed audios, fits them to the mixture duration
+    according to `strategy` and adds them together to create the mixture.
+
+    All stems are written into one float32 (n_stems, n_samples) matrix (see
+    `stack_stems`) and summed with a single reduction. The ``audio`` of
+    each stem becomes a view of its row.
 
     Parameters
     ----------
@@ -234,20 +982,28 @@ def mix(duration, stems, strategy="zeros", sr=22050):
         * zeros: add silence to the end of the stem (default)
         * cut: cut all stems to minimum lenght
         * repeat: repeat stem and cut it to match mixture duration
+    sr : int
+        sample rate
+    return_matrix : bool
+        if True, also return the stem matrix
 
     Returns
     ----------
-    None
+    mixture_audio : np.ndarray
+        mixture
+    stems : list[dict]
+        stems with their final ``audio``
+    stem_matrix : np.ndarray
+        only if `return_matrix` is True
     """
+    stem_matrix = stack_stems(duration, stems, strategy=strategy, sr=sr)
+    mixture_audio = stem_matrix.sum(axis=0)
 
-    mixture_length = int(duration * sr)
-    mixture_audio = np.zeros(mixture_length)
+    for s, stem_audio in zip(stems, stem_matrix):
+        s["audio"] = stem_audio
 
-    # TODO: implement strategies
-    for s in stems:
-        # pad ending with zeros
-        s["audio"] = librosa.util.fix_length(data=s["audio"], size=mixture_length)
-        mixture_audio += s["audio"]
+    if return_matrix:
+        return mixture_audio, stems, stem_matrix
 
     return mixture_audio, stems
 
@@ -261,6 +1017,27 @@ def generate_mixtures(
     duration,
     index_file="index.csv",
     output_folder="mixtures",
+    workers=1,
+    seed=None,
+    sampler=None,
+    cache=None,
+    writer=None,
+    random_offset=False,
+    sr=22050,
+    strategy="zeros",
+    target_db=None,
+    gain_range_db=None,
+    peak=None,
+    index_rms=False,
+    start=0,
+    resume=False,
+    io_threads=2,
+    prefetch=None,
+    profiler=None,
+    stretch="phase_vocoder",
+    stretch_tolerance=None,
+    batch_stretch=False,
+    store=None,
 ):
     """
     Main method to generate mixtures
@@ -279,23 +1056,634 @@ def generate_mixtures(
         number of percussive stems
     duration : float
         mixture duration
+    index_file : str
+        index file with pre-computed features
+    output_folder : str
+        path to folder where we will save mixtures
+    workers : int
+        number of worker processes stretching and mixing stems. if 1
+        (default), stems are stretched and mixed in the current process.
+    seed : int or None
+        if provided, mixture ``i`` is always generated with a random
+        generator seeded with ``(seed, i)``, no matter which worker renders
+        it, and is saved as ``mixture_id(seed, i)``. any single mixture can
+        be regenerated with ``start=i, n_mixtures=1``.
+    sampler : StemSampler or None
+        pre-loaded index. if None, `index_file` is read once from
+        `data_home` and shared by all mixtures.
+    cache : AudioCache or None
+        cache of time-stretched stems shared by all mixtures
+    writer : ShardWriter or None
+        if provided, mixtures are sent to this writer instead of being saved
+        by `save_mixture` into `output_folder`. the caller is responsible
+        for closing it.
+    random_offset : bool
+        if True, each mixture uses stem excerpts starting at random points.
+        see `time_stretch`.
+    sr : int
+        sample rate of the mixtures. stems already at this sample rate are
+        not resampled.
+    strategy : str
+        strategy to deal with stems shorter than the mixture. see `mix`.
+    target_db : float or None
+        target RMS of every stem in dBFS. if None, stems are scaled to the
+        quietest stem. see `loudness`.
+    gain_range_db : tuple or None
+        ``(low, high)`` range of a random gain in dB added to each stem
+    peak : float or None
+        maximum absolute peak of the mixture
+    index_rms : bool
+        if True, use the RMS of the whole stem stored in the index instead of
+        measuring it on the mixture excerpt
+    start : int
+        index of the first mixture. a large job can be split across machines
+        by giving each one a different range of mixture indices and output
+        folder.
+    resume : bool
+        if True, mixtures already logged in ``<output_folder>/run.jsonl`` by
+        a previous run with the same configuration are skipped. otherwise
+        every mixture is rendered again; a log with the same configuration
+        is appended to, so regenerating some mixtures in place (e.g.
+        ``start=i, n_mixtures=1``) keeps the log of the others, and a log
+        with another configuration is started over. see `RunManifest`.
+        with a `writer` and a
+        `seed`, mixtures the previous run wrote to a shard but did not log
+        are skipped too, so shards never hold the same mixture twice.
+    io_threads : int
+        number of threads reading stems and writing mixtures while other
+        mixtures are stretched and mixed. if 0, reads and writes happen in
+        the current thread.
+    prefetch : int or None
+        maximum number of mixtures read ahead of the stretch and mix stage.
+        defaults to twice the number of workers.
+    profiler : Profiler or None
+        if provided, the time spent in every stage of every mixture is
+        added to this profiler. see `Profiler`. with a `writer`, mixtures
+        are added once flushed to their shard, so the profiler is complete
+        once the writer is closed.
+    stretch : str
+        time stretch backend: ``"phase_vocoder"``, ``"resample"`` or
+        ``"hybrid"``. see `time_stretch`.
+    stretch_tolerance : float or None
+        stems whose stretch rate is within this tolerance of 1.0 or of an
+        octave are not stretched. see `time_stretch`.
+    batch_stretch : bool
+        if True, the stems of a mixture are stretched together by
+        `time_stretch_batch`. only applies to the phase vocoder.
+    store : StemStore or None
+        if provided, stems packed in the store at `sr` are not decoded by
+        the I/O threads: the process stretching them slices them from its
+        own memory map of the store. worker processes map the same file, so
+        the packed audio is held once in the OS page cache instead of being
+        copied to every worker. see `store.pack`.
 
     Returns
     -------
     None
     """
+    if sampler is None:
+        sampler = StemSampler.from_file(data_home, index_file)
+
+    # compute the tempo choices once for all mixtures
+    sampler.tempo_choices(n_harmonic, n_percussive)
+
+    config = dict(
+        data_home=data_home,
+        index_file=index_file,
+        n_harmonic=n_harmonic,
+        n_percussive=n_percussive,
+        duration=duration,
+        seed=seed,
+        random_offset=random_offset,
+        sr=sr,
+        strategy=strategy,
+        target_db=target_db,
+        gain_range_db=gain_range_db,
+        peak=peak,
+        index_rms=index_rms,
+        stretch=stretch,
+        stretch_tolerance=stretch_tolerance,
+        batch_stretch=batch_stretch,
+        store=None if store is None else store.path,
+    )
+    manifest = RunManifest(
+        os.path.join(output_folder, RUN_MANIFEST), config=config, resume=resume
+    )
+    mixture_indices = range(start, start + n_mixtures)
+    if resume:
+        mixture_indices = manifest.pending(mixture_indices)
+
+    if writer is None and resume:
+        _remove_partial_mixtures(output_folder)
+    elif resume and seed is not None:
+        # mixtures flushed to a shard by a run that crashed before logging
+        # them. unseeded mixtures get new ids and are written again.
+        for i in mixture_indices:
+            mix_id = mixture_id(seed, i)
+            if mix_id in writer.written:
+                manifest.add(i, mix_id, writer.metadata(mix_id))
+        mixture_indices = manifest.pending(mixture_indices)
+
+    prepare = functools.partial(
+        _prepare_mixture,
+        sampler=sampler,
+        n_harmonic=n_harmonic,
+        n_percussive=n_percussive,
+        duration=duration,
+        seed=seed,
+        random_offset=random_offset,
+        stretch=stretch,
+        stretch_tolerance=stretch_tolerance,
+        profile=profiler is not None,
+    )
+    decode = functools.partial(_decode_mixture, sr=sr, cache=cache, store=store)
+    process = functools.partial(
+        _process_mixture,
+        duration=duration,
+        sr=sr,
+        cache=cache,
+        strategy=strategy,
+        target_db=target_db,
+        gain_range_db=gain_range_db,
+        peak=peak,
+        index_rms=index_rms,
+        batch_stretch=batch_stretch,
+        store=store,
+    )
+    write = functools.partial(
+        _write_mixture, output_folder=output_folder, sr=sr, save=writer is None
+    )
+
+    workers = max(1, workers or 1)
+    if prefetch is None:
+        prefetch = 2 * workers
+
+    pbar = tqdm.tqdm(total=n_mixtures, initial=n_mixtures - len(mixture_indices))
+    pbar.set_description("Generating mixtures")
+
+    with contextlib.ExitStack() as stack:
+        io_pool = None
+        if io_threads > 0:
+            io_pool = stack.enter_context(
+                concurrent.futures.ThreadPoolExecutor(io_threads)
+            )
+        dsp_pool = None
+        if workers > 1:
+            # workers compile the DSP code while the first stems are read
+            dsp_pool = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(
+                    workers,
+                    initializer=warm_up,
+                    initargs=(sr, sampler.missing_beat_times),
+                )
+            )
+
+        stages = [
+            Stage(decode, io_pool, prefetch),
+            Stage(process, dsp_pool, 2 * workers if dsp_pool else 1),
+            Stage(write, io_pool, 2 * max(1, io_threads)),
+        ]
+        for job in run_stages(map(prepare, mixture_indices), stages):
+            i, mix_id, stems = job["mixture_index"], job["mixture_id"], job["stems"]
+            if writer is None:
+                manifest.add(i, mix_id, stems)
+                if profiler is not None:
+                    profiler.add(i, job["events"])
+            else:
+                # only logged and profiled once the writer has flushed it to
+                # a shard. the write event times the call to write, which
+                # blocks when the writer falls behind
+                enqueued = threading.Event()
+                with timed(job["events"], "write") as event:
+                    on_written = functools.partial(
+                        _on_written, manifest, profiler, job, event, enqueued
+                    )
+                    writer.write(job["mixture"], stems, mix_id, on_written=on_written)
+                    event["samples"] = job["mixture"].size + job["stem_matrix"].size
+                enqueued.set()
+            pbar.update()
+
+    pbar.close()
+
+    return
 
-    stems, base_tempo = select_stems(n_percussive, n_harmonic, data_home,
-            index_file, base_stem=None)
-    stems = time_stretch(stems, base_tempo, duration)
-    stems = align_first_beat(stems)
-    stems = normalize(stems)
 
-    mixture, stems = mix(duration, stems)
-    save_mixture(output_folder, mixture, stems)
+def _on_written(manifest, profiler, job, event, enqueued, n_bytes):
+    # called by the writer thread once a mixture is flushed to a shard
+    manifest.add(job["mixture_index"], job["mixture_id"], job["stems"])
+    if profiler is not None:
+        # the write event is complete once write returned
+        enqueued.wait()
+        event["bytes"] = n_bytes
+        profiler.add(job["mixture_index"], job["events"])
+
+
+# log of completed mixtures in the output folder
+RUN_MANIFEST = "run.jsonl"
+
+# prefix of the folders mixtures are written to before being renamed
+_PARTIAL_PREFIX = ".partial-"
+
+
+def _remove_partial_mixtures(output_folder):
+    # mixtures interrupted while being saved by a previous run
+    for name in os.listdir(output_folder):
+        if name.startswith(_PARTIAL_PREFIX):
+            shutil.rmtree(os.path.join(output_folder, name), ignore_errors=True)
+
+
+def warm_up(sr=22050, beat_track=False):
+    r"""
+    Import and compile the DSP code used to render mixtures
+
+    librosa imports its submodules on first use and compiles some of its
+    functions with numba on first call, which takes seconds. Calling this
+    function when a worker process starts moves that cost out of the first
+    mixture, e.g. as the initializer of a process pool.
+
+    Parameters
+    ----------
+    sr : int
+        sample rate of the mixtures
+    beat_track : bool
+        if True, also compile beat tracking. it is only used for stems
+        without a beat grid in the index, see `align_first_beat`.
+
+    Returns
+    -------
+    None
+    """
+    y = np.zeros(sr, dtype=np.float32)
+    y[:: sr // 4] = 1.0
+
+    librosa.effects.trim(y)
+    librosa.effects.time_stretch(y, rate=1.5)
+    if beat_track:
+        librosa.beat.beat_track(y=y, sr=sr)
 
     return
 
+
+def mixture_id(seed, mixture_index):
+    r"""
+    Deterministic id of a mixture
+
+    Parameters
+    ----------
+    seed : int or None
+        seed of the run. if None, a random id is returned.
+    mixture_index : int
+        index of the mixture in the run
+
+    Returns
+    -------
+    mixture_id : str
+    """
+    if seed is None:
+        return str(uuid.uuid4())
+
+    return f"{seed}_{mixture_index:08d}"
+
+
+def _render_mixture(
+    sampler,
+    mixture_index,
+    n_harmonic,
+    n_percussive,
+    duration,
+    seed=None,
+    cache=None,
+    random_offset=False,
+    sr=22050,
+    strategy="zeros",
+    target_db=None,
+    gain_range_db=None,
+    peak=None,
+    index_rms=False,
+    stretch="phase_vocoder",
+    stretch_tolerance=None,
+    batch_stretch=False,
+    store=None,
+):
+    # returns (mixture, stem_matrix, stems). the audio of every stem is a
+    # row of stem_matrix
+    job = _prepare_mixture(
+        mixture_index,
+        sampler,
+        n_harmonic,
+        n_percussive,
+        duration,
+        seed=seed,
+        random_offset=random_offset,
+        stretch=stretch,
+        stretch_tolerance=stretch_tolerance,
+    )
+    job = _decode_mixture(job, sr=sr, cache=cache, store=store)
+    job = _process_mixture(
+        job,
+        duration,
+        sr=sr,
+        cache=cache,
+        strategy=strategy,
+        target_db=target_db,
+        gain_range_db=gain_range_db,
+        peak=peak,
+        index_rms=index_rms,
+        batch_stretch=batch_stretch,
+        store=store,
+    )
+    job = _write_mixture(job, save=False)
+
+    return job["mixture"], job["stem_matrix"], job["stems"]
+
+
+# a mixture goes through the following stages, each one receiving and
+# returning a dict describing the mixture (a job). _decode_mixture and
+# _write_mixture are I/O bound, _process_mixture is CPU bound.
+
+
+def _prepare_mixture(
+    mixture_index,
+    sampler,
+    n_harmonic,
+    n_percussive,
+    duration,
+    seed=None,
+    random_offset=False,
+    stretch="phase_vocoder",
+    stretch_tolerance=None,
+    profile=False,
+):
+    # samples the stems and the windows to read. if profile is True, every
+    # stage records timing events in job["events"]
+    events = [] if profile else None
+
+    # without a seed, every mixture draws fresh OS entropy, so concurrent
+    # mixtures never repeat each other
+    if seed is None:
+        rng = np.random.default_rng()
+    else:
+        rng = np.random.default_rng([seed, mixture_index])
+
+    with timed(events, "sample"):
+        stems, base_tempo = sampler.sample(n_percussive, n_harmonic, rng=rng)
+        reads = _plan_reads(
+            stems,
+            base_tempo,
+            duration,
+            random_offset=random_offset,
+            rng=rng,
+            backend=stretch,
+            tolerance=stretch_tolerance,
+        )
+
+    return {
+        "mixture_index": mixture_index,
+        "mixture_id": mixture_id(seed, mixture_index),
+        "stems": stems,
+        "reads": reads,
+        "rng": rng,
+        "events": events,
+    }
+
+
+def _decode_mixture(job, sr=22050, cache=None, store=None):
+    # reads the stems audio. packed stems are left to _slice_packed
+    job["audio"] = []
+    for s, read in zip(job["stems"], job["reads"]):
+        if store is not None and store.contains(s, sr=sr):
+            job["audio"].append(None)
+            continue
+
+        with timed(job["events"], "load", stem=s["stem_name"]) as event:
+            y = _load_stem(s, read, sr=sr, cache=cache)
+            event.update(samples=len(y), cache_hit=read["cached"])
+        if job["events"] is not None:
+            event["bytes"] = _bytes_read(read)
+        job["audio"].append(y)
+
+    return job
+
+
+def _bytes_read(read):
+    # bytes of the stem file covered by the window that was decoded. 0 if
+    # the stem came from the cache or the store. the share of the file size
+    # also holds for compressed formats.
+    if read["cached"] or read["packed"]:
+        return 0
+
+    info = sf.info(read["path"])
+    if info.frames == 0:
+        return 0
+    start = min(int(round(read["offset"] * info.samplerate)), info.frames)
+    frames = min(int(round(read["duration"] * info.samplerate)), info.frames - start)
+
+    return int(os.path.getsize(read["path"]) * frames / info.frames)
+
+
+def _process_mixture(
+    job,
+    duration,
+    sr=22050,
+    cache=None,
+    strategy="zeros",
+    target_db=None,
+    gain_range_db=None,
+    peak=None,
+    index_rms=False,
+    batch_stretch=False,
+    store=None,
+):
+    # stretches, aligns and mixes the stems
+    if store is not None:
+        job = _slice_packed(job, sr=sr, cache=cache, store=store)
+    events = job["events"]
+    stems = job["stems"]
+    reads, ys = job.pop("reads"), job.pop("audio")
+    if batch_stretch:
+        with timed(events, "stretch", stems=len(stems)) as event:
+            _stretch_stems(stems, reads, ys, sr=sr, cache=cache)
+            event.update(
+                samples=sum(len(s["stretched_audio"]) for s in stems),
+                cache_hit=sum(read["cached"] for read in reads),
+            )
+    else:
+        for s, read, y in zip(stems, reads, ys):
+            with timed(events, "stretch", stem=s["stem_name"]) as event:
+                _stretch_stem(s, read, y, sr=sr, cache=cache)
+                event.update(
+                    samples=len(s["stretched_audio"]), cache_hit=read["cached"]
+                )
+
+    with timed(events, "align"):
+        stems = align_first_beat(stems, sr=sr)
+
+    with timed(events, "mix") as event:
+        stem_matrix = stack_stems(duration, stems, strategy=strategy, sr=sr)
+        rms = [s.get("rms") for s in stems] if index_rms else None
+        mixture, gains_db = loudness(
+            stem_matrix,
+            target_db=target_db,
+            gain_range_db=gain_range_db,
+            peak=peak,
+            rms=rms,
+            rng=job.pop("rng"),
+        )
+        event["samples"] = stem_matrix.size
+
+    for s, gain_db in zip(stems, gains_db):
+        # only the stem matrix is sent back to the parent process
+        s.pop("stretched_audio", None)
+        s["gain_db"] = float(gain_db)
+
+    job.update(stems=stems, mixture=mixture, stem_matrix=stem_matrix)
+
+    return job
+
+
+def _write_mixture(job, output_folder=None, sr=22050, save=True):
+    # sets the audio of every stem and saves the mixture into output_folder
+    for s, stem_audio in zip(job["stems"], job["stem_matrix"]):
+        s["audio"] = stem_audio
+
+    if save:
+        with timed(job["events"], "write") as event:
+            save_mixture(
+                output_folder,
+                job["mixture"],
+                job["stems"],
+                sr=sr,
+                mixture_id=job["mixture_id"],
+            )
+            mixture_path = os.path.join(output_folder, job["mixture_id"])
+            event["samples"] = job["mixture"].size + job["stem_matrix"].size
+            event["bytes"] = os.path.getsize(f"{mixture_path}.json") + sum(
+                f.stat().st_size for f in os.scandir(mixture_path)
+            )
+
+    return job
+
+
+def iter_mixtures(
+    n_harmonic,
+    n_percussive,
+    duration,
+    data_home=None,
+    index_file="index.csv",
+    n_mixtures=None,
+    seed=None,
+    start=0,
+    step=1,
+    sampler=None,
+    cache=None,
+    random_offset=False,
+    sr=22050,
+    strategy="zeros",
+    target_db=None,
+    gain_range_db=None,
+    peak=None,
+    index_rms=False,
+    stretch="phase_vocoder",
+    stretch_tolerance=None,
+    batch_stretch=False,
+    store=None,
+):
+    r"""
+    Generate mixtures in memory, without writing them to disk
+
+    Mixtures ``start``, ``start + step``, ``start + 2 * step``... are
+    rendered exactly as `generate_mixtures` would, so a seeded stream
+    yields the same mixtures as a seeded run on disk.
+
+    Parameters
+    ----------
+    n_harmonic : int
+        number of harmonic stems
+    n_percussive : int
+        number of percussive stems
+    duration : float
+        mixture duration
+    data_home : str or None
+        path to stems. only used if `sampler` is None.
+    index_file : str
+        index file with pre-computed features
+    n_mixtures : int or None
+        number of mixtures. if None, mixtures are generated forever.
+    seed : int or None
+        if provided, mixture ``i`` is always generated with a random
+        generator seeded with ``(seed, i)``
+    start : int
+        index of the first mixture
+    step : int
+        difference between consecutive mixture indices. used to split a
+        stream between several workers.
+    sampler : StemSampler or None
+        pre-loaded index. if None, `index_file` is read from `data_home`.
+    cache : AudioCache or None
+        cache of time-stretched stems, so stems are only decoded and
+        stretched once
+    store : StemStore or None
+        packed stems, read instead of decoding the stem files
+    random_offset, sr, strategy, target_db, gain_range_db, peak, index_rms
+    stretch, stretch_tolerance, batch_stretch
+        see `generate_mixtures`
+
+    Yields
+    ------
+    mixture : np.ndarray
+        mixture audio
+    stem_matrix : np.ndarray
+        ``(n_stems, n_samples)`` audio of the stems after loudness
+        processing. the mixture is the sum of its rows.
+    metadata : dict
+        ``mixture_index``, ``mixture_id`` and ``stems``, the metadata of
+        every stem
+
+    Examples
+    --------
+    >>> for mixture, stem_matrix, metadata in iter_mixtures(
+    ...     1, 2, 5.0, data_home="stems", seed=0
+    ... ):
+    ...     train_step(mixture, stem_matrix)
+    """
+    if sampler is None:
+        sampler = StemSampler.from_file(data_home, index_file)
+
+    i = start
+    stop = None if n_mixtures is None else start + n_mixtures * step
+    while stop is None or i < stop:
+        mixture, stem_matrix, stems = _render_mixture(
+            sampler,
+            i,
+            n_harmonic,
+            n_percussive,
+            duration,
+            seed=seed,
+            cache=cache,
+            random_offset=random_offset,
+            sr=sr,
+            strategy=strategy,
+            target_db=target_db,
+            gain_range_db=gain_range_db,
+            peak=peak,
+            index_rms=index_rms,
+            stretch=stretch,
+            stretch_tolerance=stretch_tolerance,
+            batch_stretch=batch_stretch,
+            store=store,
+        )
+        stems = [
+            {k: v for k, v in s.items() if not isinstance(v, np.ndarray)}
+            for s in stems
+        ]
+        yield mixture, stem_matrix, {
+            "mixture_index": i,
+            "mixture_id": mixture_id(seed, i),
+            "stems": stems,
+        }
+        i += step
+
+
 def normalize(stems):
     min_rms = np.inf
 
@@ -316,10 +1704,88 @@ def normalize(stems):
     return stems
 
 
-def save_mixture(output_folder, mixture, stems, sr=22050):
+def loudness(
+    stem_matrix, target_db=None, gain_range_db=None, peak=None, rms=None, rng=None
+):
+    r"""
+    Apply per-stem gains to a stem matrix and return the mixture.
+
+    Gains are computed for all stems at once and applied in place.
+
+    Parameters
+    ----------
+    stem_matrix : np.ndarray
+        (n_stems, n_samples) matrix, see `stack_stems`
+    target_db : float or None
+        target RMS of every stem in dBFS. if None, stems are scaled to the
+        quietest stem, like `normalize`.
+    gain_range_db : tuple or None
+        ``(low, high)`` range of a random gain in dB added to each stem,
+        for augmentation
+    peak : float or None
+        if provided, stems and mixture are scaled down so the absolute peak
+        of the mixture is at most `peak`
+    rms : np.ndarray or None
+        RMS of each stem, e.g. precomputed in the index. missing (None or
+        NaN) values are measured on `stem_matrix`.
+    rng : np.random.Generator or None
+        random generator used for the random gains
+
+    Returns
+    -------
+    mixture_audio : np.ndarray
+        sum of the scaled stems
+    gains_db : np.ndarray
+        gain applied to each stem in dB
+    """
+    n_stems, n_samples = stem_matrix.shape
+
+    if rms is None:
+        rms = np.full(n_stems, np.nan)
+    rms = np.array(rms, dtype=np.float64)
+
+    missing = np.isnan(rms)
+    if missing.any():
+        measured = stem_matrix[missing]
+        rms[missing] = np.sqrt(
+            np.einsum("ij,ij->i", measured, measured) / max(n_samples, 1)
+        )
+
+    # silent stems are left untouched
+    audible = rms > 0
+    rms_db = np.zeros(n_stems)
+    rms_db[audible] = 20 * np.log10(rms[audible])
+
+    if target_db is None:
+        target_db = rms_db[audible].min() if audible.any() else 0.0
+
+    gains_db = np.where(audible, target_db - rms_db, 0.0)
+
+    if gain_range_db is not None:
+        rng = np.random.default_rng(rng)
+        gains_db += rng.uniform(gain_range_db[0], gain_range_db[1], n_stems)
+
+    stem_matrix *= (10 ** (gains_db / 20)).astype(stem_matrix.dtype)[:, None]
+    mixture_audio = stem_matrix.sum(axis=0)
+
+    if peak is not None and len(mixture_audio) > 0:
+        mixture_peak = np.max(np.abs(mixture_audio))
+        if mixture_peak > peak:
+            scale = peak / mixture_peak
+            stem_matrix *= scale
+            mixture_audio *= scale
+            gains_db += 20 * np.log10(scale)
+
+    return mixture_audio, gains_db
+
+
+def save_mixture(output_folder, mixture, stems, sr=22050, mixture_id=None):
     """
     write mixture to .wav file and metadata to .json file
 
+    The mixture folder is written under a temporary name and renamed once
+    complete, so an interrupted call never leaves a partial mixture folder.
+
     Parameters
     ----------
     output_folder : str
@@ -328,28 +1794,43 @@ def save_mixture(output_folder, mixture, stems, sr=22050):
         mixture audio
     stems : dict
         dictionary with metadata about the stems used to create the mixture
+    sr : int
+        sample rate
+    mixture_id : str or None
+        name of the mixture folder and metadata file. random if None.
 
     Returns
     -------
     None
     """
     os.makedirs(output_folder, exist_ok=True)
-    mixture_id = str(uuid.uuid4())
+    if mixture_id is None:
+        mixture_id = str(uuid.uuid4())
     mixture_path = os.path.join(output_folder, mixture_id)
+    partial_path = os.path.join(
+        output_folder, f"{_PARTIAL_PREFIX}{mixture_id}.{uuid.uuid4().hex}"
+    )
 
-    os.makedirs(mixture_path)
-    sf.write(f"{mixture_path}/mixture.wav", mixture, sr)
+    os.makedirs(partial_path)
+    sf.write(f"{partial_path}/mixture.wav", mixture, sr)
 
     for s in stems:
-        sf.write(f"{mixture_path}/{s['stem_name']}.wav", s["audio"], sr)
+        sf.write(f"{partial_path}/{s['stem_name']}.wav", s["audio"], sr)
         # remove
         s.pop("stretched_audio", None)
         s.pop("audio", None)
         s.pop("rms", None)
+        s.pop("beat_times", None)
 
-    with open(f"{mixture_path}.json", "w") as f:
+    with open(f"{partial_path}/metadata.json", "w") as f:
         json.dump(stems, f)
 
+    # seeded mixtures are regenerated with the same id
+    if os.path.isdir(mixture_path):
+        shutil.rmtree(mixture_path)
+    os.rename(partial_path, mixture_path)
+    os.replace(f"{mixture_path}/metadata.json", f"{mixture_path}.json")
+
     return
 
 
@@ -409,6 +1890,167 @@ if __name__ == "__main__":
         help="index file with pre-computed features",
         type=str,
     )
+    parser.add_argument(
+        "--workers",
+        required=False,
+        default=1,
+        help="number of worker processes used to generate mixtures",
+        type=int,
+    )
+    parser.add_argument(
+        "--seed",
+        required=False,
+        default=None,
+        help="random seed. mixtures are reproducible for a given seed",
+        type=int,
+    )
+    parser.add_argument(
+        "--start",
+        required=False,
+        default=0,
+        help="index of the first mixture, to split a seeded run across machines",
+        type=int,
+    )
+    parser.add_argument(
+        "--io_threads",
+        required=False,
+        default=2,
+        help="threads reading stems and writing mixtures",
+        type=int,
+    )
+    parser.add_argument(
+        "--prefetch",
+        required=False,
+        default=None,
+        help="mixtures read ahead of the stretch and mix stage",
+        type=int,
+    )
+    parser.add_argument(
+        "--profile",
+        required=False,
+        action="store_true",
+        help="print the time spent in every stage at the end of the run",
+    )
+    parser.add_argument(
+        "--profile_file",
+        required=False,
+        default=None,
+        help="write the stage timings of every mixture to this JSON lines file",
+        type=str,
+    )
+    parser.add_argument(
+        "--resume",
+        required=False,
+        action="store_true",
+        help="skip the mixtures already completed in output_folder by the same run",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        required=False,
+        default=None,
+        help="folder where time-stretched stems are cached",
+        type=str,
+    )
+    parser.add_argument(
+        "--cache_size",
+        required=False,
+        default=None,
+        help="maximum cache size in MB. unlimited by default",
+        type=float,
+    )
+    parser.add_argument(
+        "--store_file",
+        required=False,
+        default=None,
+        help="stems packed in data_home by stem_mixer.store, read instead of the stem files",
+        type=str,
+    )
+    parser.add_argument(
+        "--sr",
+        required=False,
+        default=22050,
+        help="sample rate of the mixtures. default is 22050",
+        type=int,
+    )
+    parser.add_argument(
+        "--strategy",
+        required=False,
+        default="zeros",
+        choices=["zeros", "cut", "repeat"],
+        help="how to fit stems shorter than the mixture. default is zeros",
+        type=str,
+    )
+    parser.add_argument(
+        "--target_db",
+        required=False,
+        default=None,
+        help="target RMS of every stem in dBFS. default scales stems to the quietest one",
+        type=float,
+    )
+    parser.add_argument(
+        "--gain_range_db",
+        required=False,
+        default=None,
+        nargs=2,
+        metavar=("LOW", "HIGH"),
+        help="range of a random gain in dB added to each stem",
+        type=float,
+    )
+    parser.add_argument(
+        "--peak",
+        required=False,
+        default=None,
+        help="maximum absolute peak of the mixture, e.g. 0.99",
+        type=float,
+    )
+    parser.add_argument(
+        "--stretch",
+        required=False,
+        default="phase_vocoder",
+        choices=["phase_vocoder", "resample", "hybrid"],
+        help="time stretch backend. resample and hybrid are faster but shift the pitch",
+        type=str,
+    )
+    parser.add_argument(
+        "--stretch_tolerance",
+        required=False,
+        default=None,
+        help="do not stretch stems within this tolerance of the base tempo or its octaves",
+        type=float,
+    )
+    parser.add_argument(
+        "--batch_stretch",
+        required=False,
+        action="store_true",
+        help="stretch the stems of a mixture together with the batched phase vocoder",
+    )
+    parser.add_argument(
+        "--index_rms",
+        required=False,
+        action="store_true",
+        help="use the stem RMS stored in the index",
+    )
+    parser.add_argument(
+        "--random_offset",
+        required=False,
+        action="store_true",
+        help="use stem excerpts starting at random points instead of the beginning",
+    )
+    parser.add_argument(
+        "--output_format",
+        required=False,
+        default="wav",
+        choices=["wav", "tar"],
+        help="wav: one folder per mixture (default). tar: WebDataset-style tar shards",
+        type=str,
+    )
+    parser.add_argument(
+        "--shard_size",
+        required=False,
+        default=1024,
+        help="maximum shard size in MB when --output_format=tar",
+        type=float,
+    )
 
     args = parser.parse_args()
 
@@ -416,11 +2058,36 @@ if __name__ == "__main__":
         args.n_harmonic = args.n_stems // 2
         args.n_percussive = args.n_stems - args.n_harmonic
 
-    pbar = tqdm.tqdm(range(args.n_mixtures))
-    pbar.set_description("Generating mixtures")
     kwargs = vars(args)
-
-    for i in pbar:
-        # each mixture has its own arguments
-        mixture_args = kwargs.copy()
-        generate_mixtures(**mixture_args)
+    cache_dir = kwargs.pop("cache_dir")
+    cache_size = kwargs.pop("cache_size")
+
+    if cache_dir is not None:
+        max_size = None if cache_size is None else int(cache_size * 1024**2)
+        kwargs["cache"] = AudioCache(cache_dir, max_size)
+
+    store_file = kwargs.pop("store_file")
+    if store_file is not None:
+        kwargs["store"] = StemStore(os.path.join(args.data_home, store_file))
+
+    output_format = kwargs.pop("output_format")
+    shard_size = kwargs.pop("shard_size")
+
+    profile = kwargs.pop("profile")
+    profile_file = kwargs.pop("profile_file")
+    if profile or profile_file is not None:
+        kwargs["profiler"] = Profiler(profile_file)
+
+    if output_format == "tar":
+        with ShardWriter(
+            kwargs["output_folder"],
+            sr=kwargs["sr"],
+            shard_size=int(shard_size * 1024**2),
+        ) as writer:
+            generate_mixtures(**kwargs, writer=writer)
+    else:
+        generate_mixtures(**kwargs)
+
+    if kwargs.get("profiler") is not None:
+        kwargs["profiler"].close()
+        kwargs["profiler"].report()
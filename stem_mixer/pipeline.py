@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. autosummary::
+   :toctree: generated/
+
+   Stage
+   run_stages
+"""
+import collections
+import concurrent.futures
+
+
+class Stage(collections.namedtuple("Stage", ["function", "executor", "depth"])):
+    r"""
+    Step of a pipeline run by `run_stages`.
+
+    Parameters
+    ----------
+    function : callable
+        function applied to every item. it receives the output of the
+        previous stage.
+    executor : concurrent.futures.Executor or None
+        executor running `function`, e.g. a thread pool for I/O bound
+        stages and a process pool for CPU bound ones. if None, `function`
+        runs in the calling thread.
+    depth : int
+        maximum number of items submitted to this stage or waiting for the
+        next one. bounds the memory used by items in flight.
+    """
+
+    __slots__ = ()
+
+
+def run_stages(items, stages):
+    r"""
+    Pass items through a sequence of stages running concurrently.
+
+    While an item is processed by a stage, the following items are already
+    processed by the previous stages, so throughput is limited by the
+    slowest stage instead of the sum of all stages. A stage that has
+    `Stage.depth` items in flight stops accepting new ones, which in turn
+    stops the previous stages: at most ``sum(depth)`` items are held in
+    memory.
+
+    Parameters
+    ----------
+    items : iterable
+        inputs of the first stage. consumed lazily.
+    stages : list[Stage]
+
+    Yields
+    ------
+    result
+        output of the last stage, in completion order
+
+    Raises
+    ------
+    Exception
+        the first exception raised by a stage. items still in flight are
+        cancelled.
+    """
+    items = iter(items)
+    n_stages = len(stages)
+    # running[k]: futures of stage k. ready[k]: outputs of stage k - 1
+    # waiting to be submitted to stage k
+    running = [set() for _ in stages]
+    ready = [collections.deque() for _ in stages]
+    stage_of = {}
+    exhausted = False
+
+    def has_room(k):
+        waiting = len(ready[k + 1]) if k + 1 < n_stages else 0
+        return len(running[k]) + waiting < stages[k].depth
+
+    def submit(k, item):
+        function, executor, _ = stages[k]
+        if executor is None:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(function(item))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = executor.submit(function, item)
+        running[k].add(future)
+        stage_of[future] = k
+
+    try:
+        while True:
+            # move items forward, starting from the last stage so the
+            # pipeline drains before new items are read
+            for k in reversed(range(n_stages)):
+                while ready[k] and has_room(k):
+                    submit(k, ready[k].popleft())
+
+            while not exhausted and has_room(0):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                submit(0, item)
+
+            in_flight = set(stage_of)
+            if not in_flight:
+                return
+
+            done, _ = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                k = stage_of.pop(future)
+                running[k].discard(future)
+                result = future.result()
+                if k + 1 < n_stages:
+                    ready[k + 1].append(result)
+                else:
+                    yield result
+    finally:
+        for future in stage_of:
+            future.cancel()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. autosummary::
+   :toctree: generated/
+
+   Profiler
+   timed
+"""
+import contextlib
+import json
+import time
+
+
+@contextlib.contextmanager
+def timed(events, stage, **fields):
+    r"""
+    Time a block of code and record it as an event.
+
+    Parameters
+    ----------
+    events : list or None
+        list the event is appended to. if None, nothing is recorded.
+    stage : str
+        name of the stage, e.g. ``"load"`` or ``"stretch"``
+    \*\*fields : dict
+        other fields of the event, e.g. the stem name
+
+    Yields
+    ------
+    event : dict
+        the event being recorded. counters such as ``samples``, ``bytes``
+        or ``cache_hit`` can be added to it inside the block.
+
+    Examples
+    --------
+    >>> events = []
+    >>> with timed(events, "load", stem="track0.wav") as event:
+    ...     y, sr = audio.load("track0.wav")
+    ...     event["samples"] = len(y)
+    """
+    event = dict(stage=stage, **fields)
+    start = time.perf_counter()
+
+    yield event
+
+    if events is not None:
+        event["seconds"] = time.perf_counter() - start
+        events.append(event)
+
+
+class Profiler:
+    r"""
+    Aggregate the stage events of a mixture generation run.
+
+    Every stage of a mixture (sampling, loading, stretching...) records an
+    event with its wall time and counters: ``samples`` processed,
+    ``bytes`` read or written and ``cache_hit``. The profiler sums them per
+    stage. Comparing the time spent in ``load`` and ``write`` with the time
+    spent in ``stretch``, ``align`` and ``mix`` tells whether a run is I/O
+    or DSP bound.
+
+    Stages of concurrent mixtures overlap, so the summed stage times may be
+    larger than the wall time of the run.
+
+    Parameters
+    ----------
+    path : str or None
+        if provided, the events of every mixture are written to this file
+        as JSON lines, followed by a line with the run summary
+    """
+
+    # counters summed over the events of a stage
+    COUNTERS = ["seconds", "samples", "bytes", "cache_hit"]
+
+    def __init__(self, path=None):
+        self.stages = {}
+        self.n_mixtures = 0
+        self._start = time.perf_counter()
+        self._file = None if path is None else open(path, "w")
+
+    def add(self, mixture_index, events):
+        r"""
+        Add the events of a mixture
+
+        Parameters
+        ----------
+        mixture_index : int
+            index of the mixture in the run
+        events : list[dict]
+            events recorded by `timed`
+        """
+        self.n_mixtures += 1
+
+        for event in events:
+            stage = self.stages.setdefault(
+                event["stage"], dict.fromkeys(["count"] + self.COUNTERS, 0)
+            )
+            stage["count"] += 1
+            for counter in self.COUNTERS:
+                stage[counter] += event.get(counter) or 0
+
+        if self._file is not None:
+            self._file.write(
+                json.dumps({"mixture_index": int(mixture_index), "events": events})
+                + "\n"
+            )
+
+        return
+
+    def summary(self):
+        r"""
+        Summary of the run so far
+
+        Returns
+        -------
+        summary : dict
+            ``mixtures``, ``wall_seconds``, ``mixtures_per_second`` and
+            ``stages``, the summed counters of every stage
+        """
+        wall_seconds = time.perf_counter() - self._start
+
+        return {
+            "mixtures": self.n_mixtures,
+            "wall_seconds": wall_seconds,
+            "mixtures_per_second": self.n_mixtures / wall_seconds,
+            "stages": self.stages,
+        }
+
+    def report(self):
+        r"""
+        Print the summary of the run
+        """
+        summary = self.summary()
+        total = sum(s["seconds"] for s in self.stages.values()) or 1.0
+
+        print(
+            f"{summary['mixtures']} mixtures in {summary['wall_seconds']:.2f}s "
+            f"({summary['mixtures_per_second']:.2f} mixtures/s)"
+        )
+        print(
+            f"{'stage':<10}{'count':>8}{'total s':>10}{'mean ms':>10}"
+            f"{'share':>8}{'samples':>14}{'MB':>10}{'hits':>8}"
+        )
+        for name, s in self.stages.items():
+            print(
+                f"{name:<10}{s['count']:>8}{s['seconds']:>10.2f}"
+                f"{1000 * s['seconds'] / s['count']:>10.2f}"
+                f"{s['seconds'] / total:>8.1%}{s['samples']:>14}"
+                f"{s['bytes'] / 1024**2:>10.1f}{s['cache_hit']:>8}"
+            )
+
+        return
+
+    def close(self):
+        r"""
+        Write the run summary and close the JSON lines file
+        """
+        if self._file is not None:
+            self._file.write(json.dumps({"summary": self.summary()}) + "\n")
+            self._file.close()
+            self._file = None
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. autosummary::
+   :toctree: generated/
+
+   RunManifest
+"""
+import json
+import os
+import threading
+
+
+class RunManifest:
+    r"""
+    Append-only log of the mixtures completed by a generation run.
+
+    The first line of the log stores the run configuration and every other
+    line one completed mixture: its index, its id and the names of the
+    stems it uses. A mixture is only logged once it is fully written, so
+    the indices missing from the log are exactly the mixtures that still
+    have to be generated.
+
+    Lines are appended one at a time and flushed immediately, so a crash
+    loses at most the line being written. A truncated last line is ignored
+    when the log is read back.
+
+    Parameters
+    ----------
+    path : str
+        path to the log, e.g. ``<output_folder>/run.jsonl``
+    config : dict or None
+        configuration of the run. when resuming, it must match the
+        configuration stored in the log.
+    resume : bool
+        if True, completed mixtures are read from an existing log and new
+        ones are appended to it. if False, an existing log with the same
+        configuration is still appended to, so mixtures regenerated in place
+        keep the rest of the log, but a log with another configuration is
+        replaced.
+
+    Raises
+    ------
+    ValueError
+        if resuming a run with a different configuration
+    """
+
+    def __init__(self, path, config=None, resume=False):
+        self.path = path
+        self.config = _to_json(config or {})
+        self.completed = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            logged_config, completed = self._read()
+            if logged_config == self.config:
+                self.completed = completed
+                return
+            if resume:
+                raise ValueError(
+                    f"Cannot resume run logged in {self.path}: configuration "
+                    f"{logged_config} does not match {self.config}"
+                )
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._append({"config": self.config}, mode="w")
+
+    def add(self, mixture_index, mixture_id, stems):
+        r"""
+        Log a completed mixture
+
+        Parameters
+        ----------
+        mixture_index : int
+            index of the mixture in the run
+        mixture_id : str
+            mixture id
+        stems : list[dict]
+            stems used in the mixture
+        """
+        stem_names = [s["stem_name"] for s in stems]
+        self._append(
+            {
+                "mixture_index": int(mixture_index),
+                "mixture_id": mixture_id,
+                "stems": stem_names,
+            }
+        )
+        self.completed[int(mixture_index)] = mixture_id
+
+        return
+
+    def pending(self, mixture_indices):
+        r"""
+        Mixture indices that are not completed yet
+
+        Parameters
+        ----------
+        mixture_indices : iterable of int
+
+        Returns
+        -------
+        pending : list[int]
+        """
+        return [i for i in mixture_indices if i not in self.completed]
+
+    def _read(self):
+        # (logged configuration, completed mixtures) of the existing log
+        with open(self.path) as f:
+            lines = f.read().split("\n")
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # empty or truncated line
+                continue
+
+        config = None
+        if entries and "config" in entries[0]:
+            config = entries.pop(0)["config"]
+
+        completed = {}
+        for entry in entries:
+            completed[entry["mixture_index"]] = entry["mixture_id"]
+
+        # a crash may have left a truncated line with no line break
+        if lines[-1]:
+            with open(self.path, "a") as f:
+                f.write("\n")
+
+        return config, completed
+
+    def _append(self, entry, mode="a"):
+        line = json.dumps(entry) + "\n"
+        with self._lock, open(self.path, mode) as f:
+            f.write(line)
+            f.flush()
+
+
+def _to_json(value):
+    # tuples become lists, so configurations compare equal to the logged ones
+    return json.loads(json.dumps(value))
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. autosummary::
+   :toctree: generated/
+
+   StemStore
+   pack
+"""
+import argparse
+import os
+import uuid
+
+import lazy_loader as lazy
+import numpy as np
+import soundfile as sf
+
+from stem_mixer import audio, metadata
+
+# imported on first use, see stem_mixer.mix
+pd = lazy.load("pandas")
+tqdm = lazy.load("tqdm")
+
+STORE_FILE = "stems.npy"
+# index columns of the offset table
+PACK_COLUMNS = ["pack_offset", "pack_length", "pack_sr"]
+# int16 stores are scaled by this factor
+_INT16_SCALE = 32767.0
+
+
+class StemStore:
+    r"""
+    Memory-mapped store of the audio of every stem in an index.
+
+    The store is a single ``.npy`` file written by `pack` with the trimmed
+    audio of every stem, resampled and concatenated. The position of every
+    stem in the file is stored in the index (``pack_offset``,
+    ``pack_length`` and ``pack_sr``), so reading a stem is a slice of the
+    memory map instead of a decode and resample. The pages are shared
+    through the OS page cache: worker processes opening the same store do
+    not duplicate it in memory.
+
+    A store is pickled by path, so passing it to a worker process does not
+    copy the audio. Every process maps the file once and reuses the mapping
+    for all the stores it unpickles.
+
+    Parameters
+    ----------
+    path : str
+        path to the store written by `pack`
+
+    Attributes
+    ----------
+    path : str
+    audio : np.memmap
+        read-only audio of all the stems
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.audio = _memmap(path)
+
+    def contains(self, stem, sr=22050):
+        r"""
+        Check whether a stem is packed in the store
+
+        Parameters
+        ----------
+        stem : dict
+            row of the index
+        sr : int
+            sample rate of the audio
+
+        Returns
+        -------
+        packed : bool
+            True if `stem` is packed at `sr`
+        """
+        pack_offset = stem.get("pack_offset")
+        if pack_offset is None or pd.isna(pack_offset):
+            return False
+
+        return bool(stem.get("pack_sr") == sr)
+
+    def get(self, stem, sr=22050, offset=0.0, duration=None):
+        r"""
+        Read a window of a packed stem
+
+        Parameters
+        ----------
+        stem : dict
+            row of the index, with the offset table columns
+        sr : int
+            sample rate of the audio
+        offset : float
+            start of the window in seconds from the beginning of the stem
+            file, as in `audio.load`
+        duration : float or None
+            length of the window in seconds. if None, read until the end of
+            the packed audio.
+
+        Returns
+        -------
+        audio : np.ndarray or None
+            read-only view of the store if it holds float32 audio, a float32
+            copy otherwise. None if the stem is not packed at `sr`.
+        """
+        if not self.contains(stem, sr=sr):
+            return None
+        pack_offset = stem["pack_offset"]
+
+        # packed audio starts at the trim boundary of the stem
+        pack_start = stem.get("trim_start")
+        if pack_start is None or pd.isna(pack_start):
+            pack_start = 0.0
+
+        length = int(stem["pack_length"])
+        start = min(max(int(round((offset - pack_start) * sr)), 0), length)
+        end = length if duration is None else min(start + int(round(duration * sr)), length)
+
+        y = self.audio[int(pack_offset) + start : int(pack_offset) + end]
+        if y.dtype == np.int16:
+            return y.astype(np.float32) / np.float32(_INT16_SCALE)
+
+        return y
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+# path -> ((inode, mtime), memory map) of the stores opened by this process
+_memmaps = {}
+
+
+def _memmap(path):
+    # the mapping of `path` is reused as long as the file is not replaced
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    key = (stat.st_ino, stat.st_mtime_ns)
+    if path not in _memmaps or _memmaps[path][0] != key:
+        _memmaps[path] = (key, np.load(path, mmap_mode="r"))
+
+    return _memmaps[path][1]
+
+
+def pack(
+    data_home,
+    index_file="index.csv",
+    store_file=STORE_FILE,
+    sr=22050,
+    dtype="float32",
+):
+    r"""
+    Write the audio of every stem of an index into a `StemStore`
+
+    Stems are read between their trim boundaries (``trim_start`` and
+    ``trim_end``), or entirely if the index has none, resampled to `sr` and
+    written one after the other. The offset table is added to the index,
+    which is written back to `index_file`. The store replaces any previous
+    one only once it is complete.
+
+    Parameters
+    ----------
+    data_home : str
+        path to stems
+    index_file : str
+        index file with pre-computed features
+    store_file : str
+        name of the store in `data_home`
+    sr : int
+        sample rate of the packed audio. mixtures generated at another
+        sample rate decode the stems instead.
+    dtype : str
+        ``"float32"``, read without copy, or ``"int16"``, half the size but
+        converted to float32 on every read
+
+    Returns
+    -------
+    df : pd.DataFrame
+        index with the offset table columns
+    """
+    if dtype not in ["float32", "int16"]:
+        raise ValueError(f"Unsupported store dtype: {dtype}")
+
+    index_path = os.path.join(data_home, index_file)
+    df = metadata.read_index(index_path)
+
+    # the store is allocated before decoding, with an upper bound of the
+    # length of every stem once resampled
+    windows = [_pack_window(data_home, stem, sr) for stem in df.to_dict("records")]
+    total = sum(bound for _, _, bound in windows)
+
+    store_path = os.path.join(data_home, store_file)
+    tmp_path = f"{store_path}.{uuid.uuid4().hex}.tmp"
+    store = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(total,))
+
+    offsets, lengths = [], []
+    position = 0
+    try:
+        for path, (offset, duration), bound in tqdm.tqdm(windows, desc="Packing stems"):
+            y, _ = audio.load(path, sr=sr, offset=offset, duration=duration)
+            y = y[:bound]
+            if dtype == "int16":
+                y = np.round(np.clip(y, -1.0, 1.0) * _INT16_SCALE)
+            store[position : position + len(y)] = y
+
+            offsets.append(position)
+            lengths.append(len(y))
+            position += bound
+
+        store.flush()
+    except BaseException:
+        del store
+        os.remove(tmp_path)
+        raise
+
+    # the memory map is closed before the file is moved
+    del store
+    os.replace(tmp_path, store_path)
+
+    df["pack_offset"] = pd.array(offsets, dtype="Int64")
+    df["pack_length"] = pd.array(lengths, dtype="Int64")
+    df["pack_sr"] = pd.array([sr] * len(df), dtype="Int64")
+
+    return metadata.write_index(df, index_path)
+
+
+def _pack_window(data_home, stem, sr):
+    # (path, (offset, duration), upper bound of the length at sr) of the
+    # audio of a stem that is packed
+    path = os.path.join(data_home, stem["stem_name"])
+    info = sf.info(path)
+    native_sr, frames = info.samplerate, info.frames
+
+    trim_start = stem.get("trim_start")
+    trim_end = stem.get("trim_end")
+    offset = 0.0 if trim_start is None or pd.isna(trim_start) else trim_start
+    duration = None if trim_end is None or pd.isna(trim_end) else trim_end - offset
+
+    if duration is not None:
+        frames = min(frames, int(round(duration * native_sr)))
+
+    return path, (offset, duration), int(np.ceil(frames * sr / native_sr)) + 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="store", description="Pack the stems of an index into a memory-mapped store"
+    )
+    parser.add_argument("--data_home", required=True, help="path to stems")
+    parser.add_argument(
+        "--index_file",
+        required=False,
+        default="index.csv",
+        help="index file with pre-computed features",
+        type=str,
+    )
+    parser.add_argument(
+        "--store_file",
+        required=False,
+        default=STORE_FILE,
+        help="name of the store in data_home",
+        type=str,
+    )
+    parser.add_argument(
+        "--sr",
+        required=False,
+        default=22050,
+        help="sample rate of the packed audio. default is 22050",
+        type=int,
+    )
+    parser.add_argument(
+        "--dtype",
+        required=False,
+        default="float32",
+        choices=["float32", "int16"],
+        help="sample format of the packed audio",
+        type=str,
+    )
+
+    args = parser.parse_args()
+    pack(**vars(args))
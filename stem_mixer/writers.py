@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. autosummary::
+   :toctree: generated/
+
+   ShardWriter
+"""
+import io
+import json
+import os
+import queue
+import tarfile
+import threading
+import time
+import uuid
+
+import numpy as np
+import soundfile as sf
+
+
+class ShardWriter:
+    r"""
+    Write mixtures into WebDataset-style tar shards.
+
+    Instead of one folder and several small files per mixture, mixtures are
+    appended to ``shard-000000.tar``, ``shard-000001.tar``... Every mixture
+    ``<id>`` is stored as ``<id>.mixture.wav``, one ``<id>.stemN.wav`` per
+    stem and ``<id>.json`` with the stems metadata, in that order.
+
+    ``shards.jsonl`` stores one line per mixture with its shard and the
+    offset and size of every member, so a mixture can be read back without
+    scanning the tar file. Mixtures already listed in ``shards.jsonl`` by a
+    previous writer are available in `written`, so an interrupted run can
+    skip them instead of writing them again.
+
+    Writing happens in a background thread: `write` only enqueues the
+    mixture and blocks when `max_queue` mixtures are waiting.
+
+    Parameters
+    ----------
+    output_folder : str
+        folder where shards are written
+    sr : int
+        sample rate
+    shard_size : int
+        a new shard is started once the current one exceeds this size in bytes
+    max_queue : int
+        maximum number of mixtures waiting to be written
+
+    Attributes
+    ----------
+    written : dict
+        mixture id -> ``shards.jsonl`` entry of the mixtures written to this
+        folder by previous writers, whose members are complete on disk
+
+    Examples
+    --------
+    >>> with ShardWriter("mixtures") as writer:
+    ...     generate_mixtures(data_home, 100, 3, 1, 2, 5.0, writer=writer)
+    """
+
+    def __init__(self, output_folder, sr=22050, shard_size=1024**3, max_queue=64):
+        self.output_folder = output_folder
+        self.sr = sr
+        self.shard_size = shard_size
+
+        os.makedirs(output_folder, exist_ok=True)
+
+        self._shard_id = self._next_shard_id()
+        self._tar = None
+        index_path = os.path.join(output_folder, "shards.jsonl")
+        self.written = self._read_index(index_path)
+        self._index = open(index_path, "a")
+
+        self._queue = queue.Queue(max_queue)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, mixture, stems, mixture_id=None, on_written=None):
+        r"""
+        Enqueue a mixture to be written
+
+        Parameters
+        ----------
+        mixture : np.array
+            mixture audio
+        stems : list[dict]
+            stems used to create the mixture. ``audio`` holds the stem audio
+            and every other non-array field is saved as metadata.
+        mixture_id : str or None
+            mixture id. random if None.
+        on_written : callable or None
+            called from the writer thread once the mixture is flushed to
+            its shard, with the number of bytes added to the shard
+
+        Returns
+        -------
+        mixture_id : str
+        """
+        self._raise_error()
+
+        if mixture_id is None:
+            mixture_id = str(uuid.uuid4())
+
+        self._queue.put((mixture_id, mixture, stems, on_written))
+
+        return mixture_id
+
+    def metadata(self, mixture_id):
+        r"""
+        Read back the stems metadata of a mixture in `written`
+
+        Parameters
+        ----------
+        mixture_id : str
+
+        Returns
+        -------
+        stems : list[dict]
+        """
+        entry = self.written[mixture_id]
+        offset, size = entry["members"][f"{mixture_id}.json"]
+        with open(os.path.join(self.output_folder, entry["shard"]), "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(size))
+
+    def close(self):
+        r"""
+        Wait for all enqueued mixtures to be written and close the shards
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+        self._index.close()
+        self._raise_error()
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            if self._error is not None:
+                # keep draining so producers never block forever
+                continue
+
+            try:
+                self._write(*item)
+            except Exception as e:
+                self._error = e
+
+        try:
+            if self._tar is not None:
+                self._tar.close()
+        except Exception as e:
+            self._error = self._error or e
+
+    def _write(self, mixture_id, mixture, stems, on_written=None):
+        if self._tar is None or self._tar.offset >= self.shard_size:
+            self._open_shard()
+
+        members = [(f"{mixture_id}.mixture.wav", _wav_bytes(mixture, self.sr))]
+        metadata = []
+        for i, s in enumerate(stems):
+            members.append((f"{mixture_id}.stem{i}.wav", _wav_bytes(s["audio"], self.sr)))
+            metadata.append(
+                {k: v for k, v in s.items() if not isinstance(v, np.ndarray)}
+            )
+        metadata = json.dumps(metadata, default=_json_default)
+        members.append((f"{mixture_id}.json", metadata.encode("utf-8")))
+
+        start = self._tar.offset
+        offsets = {}
+        for name, data in members:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tarinfo.mtime = time.time()
+            self._tar.addfile(tarinfo, io.BytesIO(data))
+            # data is written right before the current offset, padded to
+            # whole tar blocks
+            padded_size = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            offsets[name] = [self._tar.offset - padded_size, tarinfo.size]
+
+        self._index.write(
+            json.dumps(
+                {
+                    "mixture_id": mixture_id,
+                    "shard": os.path.basename(self._tar.name),
+                    "members": offsets,
+                }
+            )
+            + "\n"
+        )
+
+        if on_written is not None:
+            self._tar.fileobj.flush()
+            self._index.flush()
+            on_written(self._tar.offset - start)
+
+    def _open_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._shard_id += 1
+        self._index.flush()
+
+        shard_path = os.path.join(self.output_folder, f"shard-{self._shard_id:06d}.tar")
+        self._tar = tarfile.open(shard_path, "w")
+
+    def _read_index(self, index_path):
+        # entries of a previous index whose members were flushed to their
+        # shard. a crash may have left a truncated last line
+        written = {}
+        if not os.path.exists(index_path):
+            return written
+
+        with open(index_path) as f:
+            lines = f.read().split("\n")
+
+        shard_sizes = {}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+
+            shard = entry["shard"]
+            if shard not in shard_sizes:
+                shard_path = os.path.join(self.output_folder, shard)
+                exists = os.path.exists(shard_path)
+                shard_sizes[shard] = os.path.getsize(shard_path) if exists else 0
+            end = max(offset + size for offset, size in entry["members"].values())
+            if end <= shard_sizes[shard]:
+                written[entry["mixture_id"]] = entry
+
+        if lines[-1]:
+            with open(index_path, "a") as f:
+                f.write("\n")
+
+        return written
+
+    def _next_shard_id(self):
+        # never overwrite shards from a previous run in the same folder
+        shard_ids = [
+            int(f[len("shard-"):-len(".tar")])
+            for f in os.listdir(self.output_folder)
+            if f.startswith("shard-") and f.endswith(".tar")
+        ]
+        return max(shard_ids) + 1 if shard_ids else 0
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError("Failed to write mixture shard") from self._error
+
+
+def _json_default(value):
+    # numpy scalars, e.g. the float32 rms computed by normalize
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _wav_bytes(audio, sr):
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sr, format="WAV")
+    return buffer.getvalue()
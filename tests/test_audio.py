@@ -0,0 +1,24 @@
+import os
+
+import numpy as np
+import soundfile as sf
+
+from stem_mixer import audio
+
+STEM_PATH = os.path.join(os.path.dirname(__file__), "[0257] S2-SK2-01-SA.wav")
+
+
+def test_load_window():
+    full, sr = sf.read(STEM_PATH, dtype="float32")
+
+    y, y_sr = audio.load(STEM_PATH, sr=None, offset=1.0, duration=0.5)
+
+    assert y_sr == sr
+    np.testing.assert_array_equal(y, full[sr:sr + sr // 2])
+
+
+def test_load_resample():
+    y, sr = audio.load(STEM_PATH, sr=22050, duration=1.0)
+
+    assert sr == 22050
+    assert len(y) == 22050
@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+
+from stem_mixer.cache import AudioCache
+
+
+def test_audio_cache(tmp_path):
+    stem_path = tmp_path / "stem.wav"
+    stem_path.write_bytes(b"")
+
+    cache = AudioCache(str(tmp_path / "cache"))
+    key = cache.key(str(stem_path), sr=22050, rate=1.0)
+
+    assert cache.get(key) is None
+    assert key != cache.key(str(stem_path), sr=22050, rate=2.0)
+
+    cache.put(key, np.ones(10, dtype=np.float32))
+    np.testing.assert_array_equal(cache.get(key), np.ones(10))
+
+
+def test_audio_cache_eviction(tmp_path):
+    cache = AudioCache(str(tmp_path))
+    audio = np.zeros(1000, dtype=np.float32)
+
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, audio)
+        os.utime(tmp_path / f"{key}.npy", (i, i))
+
+    # "a" becomes the most recently used entry
+    cache.get("a")
+    cache.max_size = 2 * os.path.getsize(tmp_path / "a.npy")
+    cache.evict(cache.max_size)
+
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.get("b") is None
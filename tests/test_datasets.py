@@ -0,0 +1,66 @@
+import types
+
+import numpy as np
+import pandas as pd
+import soundfile as sf
+
+from stem_mixer import datasets
+from stem_mixer.datasets import MixtureDataset, collate
+from stem_mixer.metadata import dict_template, write_index
+
+
+def _corpus(data_home, sr):
+    # writes a two seconds tone for two percussive and two harmonic stems
+    rows = []
+    for i, sound_class in enumerate(["percussive", "percussive", "harmonic", "harmonic"]):
+        s = dict_template(str(data_home), f"track{i}.wav")
+        s["sound_class"] = sound_class
+        s["tempo"] = 100.0
+        s["tempo_bin"] = 100
+        s["beat_times"] = np.array([0.0, 0.6])
+        s["trim_start"] = 0.0
+        s["trim_end"] = 2.0
+        rows.append(s)
+
+        tone = np.sin(2 * np.pi * 110 * (i + 1) * np.arange(2 * sr) / sr)
+        sf.write(data_home / s["stem_name"], 0.1 * tone, sr)
+
+    write_index(pd.DataFrame(rows), str(data_home / "index.csv"))
+
+
+def test_mixture_dataset_shards(tmp_path, monkeypatch):
+    sr = 8000
+    n_mixtures, world_size, num_workers = 7, 2, 3
+    _corpus(tmp_path, sr)
+
+    shards = []
+    for rank in range(world_size):
+        dataset = MixtureDataset(
+            str(tmp_path), 1, 2, 0.5,
+            n_mixtures=n_mixtures, seed=0, rank=rank, world_size=world_size, sr=sr
+        )
+        rank_indices = []
+        for worker_id in range(num_workers):
+            info = types.SimpleNamespace(id=worker_id, num_workers=num_workers)
+            monkeypatch.setattr(datasets, "get_worker_info", lambda: info)
+            indices = [metadata["mixture_index"] for _, _, metadata in dataset]
+            rank_indices.extend(indices)
+            shards.append(indices)
+
+        assert len(dataset) == len(rank_indices)
+
+    indices = [i for shard in shards for i in shard]
+    assert sorted(indices) == list(range(n_mixtures))
+
+
+def test_collate(tmp_path):
+    sr = 8000
+    _corpus(tmp_path, sr)
+    dataset = MixtureDataset(str(tmp_path), 1, 2, 0.5, n_mixtures=2, seed=0, sr=sr)
+
+    mixtures, stem_matrices, metadata = collate(list(dataset))
+    assert mixtures.shape == (2, sr // 2)
+    assert stem_matrices.shape == (2, 3, sr // 2)
+    assert [m["mixture_index"] for m in metadata] == [0, 1]
+    # fields torch cannot batch are kept as they are
+    assert metadata[0]["stems"][0]["instrument_name"] is None
@@ -0,0 +1,18 @@
+import os
+
+from stem_mixer import features
+
+STEM_PATH = os.path.join(os.path.dirname(__file__), "[0257] S2-SK2-01-SA.wav")
+
+
+def test_extract():
+    stem_features = features.extract(STEM_PATH)
+
+    assert stem_features["tempo"] == features.tempo(STEM_PATH)
+    assert stem_features["tempo_bin"] == features.tempo_bin(stem_features["tempo"])
+    assert stem_features["sound_class"] == features.sound_class(STEM_PATH)
+    assert stem_features["rms"] > 0
+    assert stem_features["first_beat_time"] >= 0
+    assert stem_features["native_sr"] == 44100
+
+    assert features.extract(STEM_PATH, hpss=False)["sound_class"] is None
@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+
+import numpy as np
+import pandas as pd
+import soundfile as sf
+
+from stem_mixer import metadata
+
+
+def test_run_feature_extraction_errors(tmp_path):
+    (tmp_path / "broken.wav").write_bytes(b"not a wav file")
+
+    tasks = [
+        (str(tmp_path), "broken.wav", metadata.dict_template(str(tmp_path), "broken.wav"))
+    ]
+    records, errors = metadata.run_feature_extraction(tasks)
+
+    assert records == {}
+    assert list(errors) == ["broken.wav"]
+    assert not (tmp_path / "broken.json").exists()
+
+
+def test_update_index(tmp_path):
+    data_home = str(tmp_path)
+    records = [metadata.dict_template(data_home, f"track{i}.wav") for i in range(3)]
+    metadata.update_index(data_home, records, None)
+
+    new_record = metadata.dict_template(data_home, "track1.wav")
+    new_record["tempo"] = 120.0
+    df = metadata.update_index(data_home, [new_record], {"track2.wav"})
+
+    assert sorted(df["stem_name"]) == ["track0.wav", "track1.wav"]
+    assert df.set_index("stem_name").loc["track1.wav", "tempo"] == 120.0
+
+
+@pytest.mark.parametrize("index_file", ["index.csv", "index.parquet", "index.feather"])
+def test_read_write_index(tmp_path, index_file):
+    if not index_file.endswith(".csv"):
+        pytest.importorskip("pyarrow")
+
+    records = [metadata.dict_template(str(tmp_path), f"track{i}.wav") for i in range(3)]
+    for i, r in enumerate(records):
+        r["tempo"] = 100.0 + i
+        r["tempo_bin"] = 100 + 5 * i
+        r["sound_class"] = "harmonic"
+        r["instrument_name"] = None
+
+    index_path = str(tmp_path / index_file)
+    metadata.write_index(pd.DataFrame(records), index_path)
+    df = metadata.read_index(index_path)
+
+    assert list(df["stem_name"]) == [r["stem_name"] for r in records]
+    assert df["tempo_bin"].dtype == "Int64"
+    assert df["sound_class"].dtype == "category"
+    assert df["instrument_name"].isna().all()
+
+
+def test_process(tmp_path, monkeypatch):
+    sr = 8000
+    t = np.arange(2 * sr) / sr
+    for i, name in enumerate(["a.wav", "b.wav", "c.wav"]):
+        sf.write(tmp_path / name, 0.1 * np.sin(2 * np.pi * 110 * (i + 1) * t), sr)
+    # metadata written before the features were versioned
+    with open(tmp_path / "a.json", "w") as f:
+        json.dump(metadata.dict_template(str(tmp_path), "a.wav"), f)
+
+    extracted = []
+    extract = metadata.features.extract
+
+    def counted_extract(stem_path, **kwargs):
+        extracted.append(os.path.basename(stem_path))
+        return extract(stem_path, **kwargs)
+
+    monkeypatch.setattr(metadata.features, "extract", counted_extract)
+
+    def process():
+        extracted.clear()
+        metadata.process(str(tmp_path))
+        return sorted(extracted), metadata.read_index(str(tmp_path / "index.csv"))
+
+    stems, df = process()
+    assert stems == ["a.wav", "b.wav", "c.wav"]
+    assert df["trim_end"].notna().all()
+    assert df["beat_times"].notna().all()
+
+    # add d, touch b and delete c
+    sf.write(tmp_path / "d.wav", 0.1 * np.sin(2 * np.pi * 440 * t), sr)
+    os.utime(tmp_path / "b.wav", ns=(0, 10**9))
+    os.remove(tmp_path / "c.wav")
+
+    stems, df = process()
+    assert stems == ["b.wav", "d.wav"]
+    assert sorted(df["stem_name"]) == ["a.wav", "b.wav", "d.wav"]
+    assert df["trim_end"].notna().all()
+
+    stems, _ = process()
+    assert stems == []
@@ -1,9 +1,24 @@
+import json
+import os
+import shutil
+import tarfile
+
 import pytest
 
+import librosa
 import numpy as np
+import pandas as pd
+import soundfile as sf
 
-from stem_mixer.mix import normalize
-from stem_mixer.metadata import dict_template
+from stem_mixer.mix import (
+    STRETCH_BACKENDS, StemSampler, align_first_beat, generate_mixtures, iter_mixtures,
+    loudness, mix, mixture_id, normalize, possible_tempo_bins, time_stretch,
+    time_stretch_batch, _decode_mixture, _prepare_mixture
+)
+from stem_mixer.metadata import dict_template, write_index
+from stem_mixer.profiling import Profiler
+from stem_mixer.store import StemStore, pack
+from stem_mixer.writers import ShardWriter
 
 
 
@@ -25,3 +40,371 @@ def test_normalize():
         np.testing.assert_allclose(s["audio"], np.ones(10), rtol=1e-8, atol=0)
 
     return
+
+
+def _index():
+    rows = []
+    for i, (sound_class, tempo_bin) in enumerate(
+        [("percussive", 100), ("percussive", 100), ("harmonic", 100),
+         ("harmonic", 50), ("harmonic", 200), ("percussive", 120)]
+    ):
+        s = dict_template("data_home", f"track{i}.wav")
+        s["sound_class"] = sound_class
+        s["tempo"] = float(tempo_bin)
+        s["tempo_bin"] = tempo_bin
+        s["instrument_name"] = None
+        rows.append(s)
+
+    return pd.DataFrame(rows)
+
+
+def test_stem_sampler():
+    sampler = StemSampler(_index())
+
+    assert sampler.tempo_choices(1, 2) == [100]
+    assert sampler.missing_beat_times
+
+    for _ in range(10):
+        stems, base_tempo = sampler.sample(2, 1)
+        assert base_tempo == 100
+        assert [s["sound_class"] for s in stems] == [
+            "percussive", "percussive", "harmonic"
+        ]
+        assert len(set(s["stem_name"] for s in stems)) == 3
+
+
+def test_stem_sampler_seeded():
+    sampler = StemSampler(_index())
+
+    def names(seed):
+        stems, _ = sampler.sample(2, 1, rng=np.random.default_rng([seed, 3]))
+        return [s["stem_name"] for s in stems]
+
+    assert names(7) == names(7)
+    assert mixture_id(7, 3) == mixture_id(7, 3) == "7_00000003"
+    assert mixture_id(None, 3) != mixture_id(None, 3)
+
+
+def test_possible_tempo_bins():
+    index = _index()
+
+    assert possible_tempo_bins(index, 1, 2) == [100]
+    # only possible when counting the 50 and 200 bpm octaves
+    assert possible_tempo_bins(index, 3, 2) == [100]
+    assert possible_tempo_bins(index, 4, 0) == []
+    assert possible_tempo_bins(index, 0, 1) == [100, 120]
+
+    # stems of the base stem instrument are never drawn with it
+    index["instrument_name"] = ["pandeiro"] * 2 + [None] * 3 + ["pandeiro"]
+    assert possible_tempo_bins(index, 0, 2) == []
+    assert possible_tempo_bins(index, 1, 1) == [100]
+    index.loc[5, "tempo_bin"] = 100
+    index.loc[5, "instrument_name"] = "tamborim"
+    assert possible_tempo_bins(index, 0, 2) == [100]
+
+    sampler = StemSampler(index)
+    for seed in range(10):
+        stems, _ = sampler.sample(2, 0, rng=np.random.default_rng(seed))
+        # the tamborim is always drawn, as the base stem or with a pandeiro
+        assert sorted(s["instrument_name"] for s in stems) == ["pandeiro", "tamborim"]
+    with pytest.raises(ValueError, match="No tempo bin"):
+        sampler.sample(4, 0)
+
+
+def test_align_first_beat_from_beat_grid():
+    sr = 100
+    s1 = dict_template("data_home", "track1")
+    s1.update(beat_times=[0.5, 1.5], segment_start=1.0, stretch_rate=2.0)
+    s2 = dict_template("data_home", "track2")
+    s2.update(beat_times=[0.0, 0.5], segment_start=0.0, stretch_rate=1.0)
+
+    for s in [s1, s2]:
+        s["stretched_audio"] = np.ones(sr)
+
+    s1, s2 = align_first_beat([s1, s2], sr=sr)
+
+    assert s1["first_beat_time"] == 0.25
+    assert s2["first_beat_time"] == 0.0
+    assert len(s1["audio"]) == sr
+    assert len(s2["audio"]) == sr + 25
+
+
+@pytest.mark.parametrize("strategy, expected", [
+    ("zeros", [[1, 2, 3, 0, 0], [4, 5, 6, 7, 8]]),
+    ("cut", [[1, 2, 3], [4, 5, 6]]),
+    ("repeat", [[1, 2, 3, 1, 2], [4, 5, 6, 7, 8]]),
+])
+def test_mix_strategies(strategy, expected):
+    s1 = dict_template("data_home", "track1")
+    s1["audio"] = np.array([1, 2, 3])
+    s2 = dict_template("data_home", "track2")
+    s2["audio"] = np.array([4, 5, 6, 7, 8, 9])
+
+    mixture, stems, stem_matrix = mix(1, [s1, s2], strategy, sr=5, return_matrix=True)
+
+    assert stem_matrix.dtype == np.float32
+    np.testing.assert_array_equal(stem_matrix, expected)
+    np.testing.assert_array_equal(mixture, np.sum(expected, axis=0))
+    np.testing.assert_array_equal(stems[0]["audio"], expected[0])
+
+
+def test_loudness():
+    stem_matrix = np.array([np.ones(10), np.ones(10) * 2, np.zeros(10)], dtype=np.float32)
+
+    mixture, gains_db = loudness(stem_matrix.copy())
+    np.testing.assert_allclose(mixture, np.ones(10) * 2, rtol=1e-6)
+    np.testing.assert_allclose(gains_db, [0, -20 * np.log10(2), 0], atol=1e-6)
+
+    scaled = stem_matrix.copy()
+    mixture, _ = loudness(scaled, target_db=-20, peak=0.15)
+    np.testing.assert_allclose(scaled[0], np.ones(10) * 0.075, rtol=1e-6)
+    np.testing.assert_allclose(np.abs(mixture).max(), 0.15, rtol=1e-6)
+
+    # precomputed rms: only the missing one is measured
+    scaled = stem_matrix.copy()
+    loudness(scaled, target_db=0, rms=[0.5, np.nan, np.nan])
+    np.testing.assert_allclose(scaled[0], np.ones(10) * 2, rtol=1e-6)
+    np.testing.assert_allclose(scaled[1], np.ones(10), rtol=1e-6)
+
+
+def _corpus(data_home, sr):
+    # writes a two seconds tone for every stem of _index
+    index = _index()
+    index["data_home"] = str(data_home)
+    index["beat_times"] = [np.array([0.0, 0.6])] * len(index)
+    index["trim_start"] = 0.0
+    index["trim_end"] = 2.0
+    for i, stem_name in enumerate(index["stem_name"]):
+        tone = np.sin(2 * np.pi * 110 * (i + 1) * np.arange(2 * sr) / sr)
+        sf.write(data_home / stem_name, 0.1 * tone, sr)
+
+    return index
+
+
+def _mixture_files(output_folder):
+    # relative path -> content of every mixture file written by a run. the
+    # run log is left out, its lines are in completion order
+    return {
+        str(path.relative_to(output_folder)): path.read_bytes()
+        for path in sorted(output_folder.rglob("*"))
+        if path.is_file() and path.name != "run.jsonl"
+    }
+
+
+def test_iter_mixtures(tmp_path):
+    sr = 8000
+    sampler = StemSampler(_corpus(tmp_path, sr))
+    assert not sampler.missing_beat_times
+    mixtures = list(
+        iter_mixtures(1, 2, 1.0, sampler=sampler, n_mixtures=3, seed=0, sr=sr)
+    )
+
+    assert [m[2]["mixture_index"] for m in mixtures] == [0, 1, 2]
+    for mixture, stem_matrix, metadata in mixtures:
+        assert stem_matrix.shape == (3, sr)
+        np.testing.assert_allclose(mixture, stem_matrix.sum(axis=0), atol=1e-6)
+        assert all("audio" not in s for s in metadata["stems"])
+
+    # every other mixture of the same seeded stream
+    mixture, _, metadata = next(
+        iter_mixtures(1, 2, 1.0, sampler=sampler, seed=0, start=2, step=2, sr=sr)
+    )
+    assert metadata["mixture_id"] == mixtures[2][2]["mixture_id"]
+    np.testing.assert_allclose(mixture, mixtures[2][0])
+
+
+def test_generate_mixtures_workers(tmp_path):
+    sr = 8000
+    sampler = StemSampler(_corpus(tmp_path, sr))
+
+    outputs = []
+    for workers in [1, 2]:
+        output_folder = tmp_path / f"workers{workers}"
+        generate_mixtures(
+            str(tmp_path), 4, 3, 1, 2, 1.0,
+            output_folder=str(output_folder),
+            workers=workers,
+            seed=0,
+            sampler=sampler,
+            sr=sr,
+        )
+        outputs.append(_mixture_files(output_folder))
+
+    # seeded mixtures do not depend on the worker that renders them
+    assert sum(name.endswith("mixture.wav") for name in outputs[0]) == 4
+    assert outputs[0] == outputs[1]
+
+
+def test_generate_mixtures_resume(tmp_path):
+    sr = 8000
+    sampler = StemSampler(_corpus(tmp_path, sr))
+    output_folder = tmp_path / "mixtures"
+
+    def generate(resume, writer=None, start=0, n_mixtures=4):
+        generate_mixtures(
+            str(tmp_path), n_mixtures, 3, 1, 2, 1.0,
+            output_folder=str(output_folder),
+            start=start,
+            seed=0,
+            sampler=sampler,
+            sr=sr,
+            resume=resume,
+            writer=writer,
+        )
+
+    generate(resume=False)
+    expected = _mixture_files(output_folder)
+
+    # a crash after mixtures 0 and 2 were logged, while 1 was being saved
+    log = (output_folder / "run.jsonl").read_text().splitlines()
+    (output_folder / "run.jsonl").write_text("\n".join(log[:1] + log[1:3]) + "\n")
+    done = [json.loads(line)["mixture_id"] for line in log[1:3]]
+    for mix_id in done:
+        (output_folder / f"{mix_id}.json").write_text("logged")
+    missing = next(i for i in range(4) if mixture_id(0, i) not in done)
+    shutil.rmtree(output_folder / mixture_id(0, missing))
+    (output_folder / ".partial-crashed").mkdir()
+
+    generate(resume=True)
+
+    files = _mixture_files(output_folder)
+    # logged mixtures are skipped and the others written again
+    for mix_id in done:
+        assert files.pop(f"{mix_id}.json") == b"logged"
+        del expected[f"{mix_id}.json"]
+    assert files == expected
+    assert not (output_folder / ".partial-crashed").exists()
+    assert len((output_folder / "run.jsonl").read_text().splitlines()) == 5
+
+    # regenerating a mixture in place keeps the log of the others
+    generate(resume=False, start=2, n_mixtures=1)
+    assert len((output_folder / "run.jsonl").read_text().splitlines()) == 6
+    files = _mixture_files(output_folder)
+    generate(resume=True)
+    assert _mixture_files(output_folder) == files
+
+    # tar shards: a crash after the mixtures were flushed but before they
+    # were logged
+    output_folder = tmp_path / "shards"
+    with ShardWriter(str(output_folder), sr=sr) as writer:
+        generate(resume=False, writer=writer)
+    log = (output_folder / "run.jsonl").read_text().splitlines()
+    (output_folder / "run.jsonl").write_text(log[0] + "\n")
+
+    with ShardWriter(str(output_folder), sr=sr) as writer:
+        generate(resume=True, writer=writer)
+
+    shards = (output_folder / "shards.jsonl").read_text().splitlines()
+    assert len(shards) == 4
+    assert sorted(json.loads(line)["mixture_id"] for line in shards) == [
+        mixture_id(0, i) for i in range(4)
+    ]
+    assert sorted(os.listdir(output_folder)) == [
+        "run.jsonl", "shard-000000.tar", "shards.jsonl"
+    ]
+    assert len((output_folder / "run.jsonl").read_text().splitlines()) == 5
+
+
+def test_generate_mixtures_profile(tmp_path):
+    sr = 8000
+    sampler = StemSampler(_corpus(tmp_path, sr))
+    output_folder = tmp_path / "shards"
+
+    profiler = Profiler()
+    with ShardWriter(str(output_folder), sr=sr) as writer:
+        generate_mixtures(
+            str(tmp_path), 3, 3, 1, 2, 1.0,
+            output_folder=str(output_folder),
+            seed=0,
+            sampler=sampler,
+            sr=sr,
+            writer=writer,
+            profiler=profiler,
+        )
+    stages = profiler.summary()["stages"]
+
+    # stems are 2 s long and 16 bit, at most (1 s + 1 beat) is read from each
+    assert stages["load"]["count"] == 9
+    assert 9 * sr * 2 <= stages["load"]["bytes"] <= 9 * 2 * sr * 2
+    assert stages["write"]["count"] == 3
+    # the shard ends with the end of archive blocks
+    shard_size = os.path.getsize(output_folder / "shard-000000.tar")
+    assert 0 < shard_size - stages["write"]["bytes"] <= tarfile.RECORDSIZE
+
+
+def test_generate_mixtures_store(tmp_path):
+    sr = 8000
+    write_index(_corpus(tmp_path, sr), str(tmp_path / "index.csv"))
+    pack(str(tmp_path), sr=sr)
+    store = StemStore(str(tmp_path / "stems.npy"))
+    sampler = StemSampler.from_file(str(tmp_path))
+
+    # packed stems are not read by the I/O threads
+    job = _decode_mixture(
+        _prepare_mixture(0, sampler, 1, 2, 1.0, seed=0), sr=sr, store=store
+    )
+    assert job["audio"] == [None, None, None]
+
+    outputs = []
+    for workers in [1, 2]:
+        output_folder = tmp_path / f"workers{workers}"
+        profiler = Profiler()
+        generate_mixtures(
+            str(tmp_path), 3, 3, 1, 2, 1.0,
+            output_folder=str(output_folder),
+            workers=workers,
+            seed=0,
+            sampler=sampler,
+            sr=sr,
+            profiler=profiler,
+            store=store,
+        )
+        outputs.append(_mixture_files(output_folder))
+        load = profiler.summary()["stages"]["load"]
+        assert load["count"] == 9
+        assert load["bytes"] == 0
+
+    assert outputs[0] == outputs[1]
+
+
+@pytest.mark.parametrize("backend", ["phase_vocoder", "resample", "hybrid"])
+def test_time_stretch_backends(tmp_path, backend):
+    sr = 8000
+    sf.write(tmp_path / "track.wav", np.sin(np.arange(4 * sr) / 10), sr)
+
+    def stem(tempo):
+        s = dict_template(str(tmp_path), "track.wav")
+        s.update(tempo=tempo, trim_start=0.0, trim_end=4.0)
+        return s
+
+    stems = [stem(100.0), stem(98.0), stem(51.0), stem(80.0)]
+    stems = time_stretch(
+        stems, 100.0, duration=1.0, sr=sr, backend=backend, tolerance=0.03
+    )
+
+    # same tempo, within tolerance and octave within tolerance
+    assert [s["stretch_rate"] for s in stems[:3]] == [1.0, 1.0, 1.0]
+    assert stems[3]["stretch_rate"] == pytest.approx(1.25)
+    for s in stems:
+        read = int(round((1.0 * s["stretch_rate"] + 60.0 / s["tempo"]) * sr))
+        assert len(s["stretched_audio"]) == pytest.approx(
+            read / s["stretch_rate"], abs=2
+        )
+    assert set(STRETCH_BACKENDS) >= {"phase_vocoder", "resample", "hybrid"}
+
+
+def test_time_stretch_batch():
+    sr = 8000
+    rng = np.random.default_rng(0)
+    ys = [
+        np.sin(np.arange(n) / 10).astype(np.float32) * rng.uniform(0.5, 1.0)
+        for n in [2 * sr, 3 * sr, sr // 2]
+    ]
+    rates = [0.8, 1.25, 1.03]
+
+    stretched = time_stretch_batch(ys, rates)
+
+    for y, rate, z in zip(ys, rates, stretched):
+        expected = librosa.effects.time_stretch(y, rate=rate)
+        assert z.shape == expected.shape
+        np.testing.assert_allclose(z, expected, atol=0.05)
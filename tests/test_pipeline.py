@@ -0,0 +1,24 @@
+import concurrent.futures
+
+import pytest
+
+from stem_mixer.pipeline import Stage, run_stages
+
+
+def _square(x):
+    return x * x
+
+
+def _fail(x):
+    if x == 3:
+        raise ValueError(x)
+    return x
+
+
+def test_run_stages():
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        stages = [Stage(_square, pool, 2), Stage(str, None, 1), Stage(int, pool, 3)]
+        assert sorted(run_stages(range(10), stages)) == [i * i for i in range(10)]
+
+        with pytest.raises(ValueError):
+            list(run_stages(range(10), [Stage(_fail, pool, 2)]))
@@ -0,0 +1,32 @@
+import json
+
+from stem_mixer.profiling import Profiler, timed
+
+
+def test_profiler(tmp_path):
+    events = []
+    with timed(events, "load", stem="track0.wav") as event:
+        event.update(samples=100, bytes=400, cache_hit=True)
+    with timed(events, "stretch", stem="track0.wav"):
+        pass
+    with timed(None, "mix"):
+        pass
+
+    assert [e["stage"] for e in events] == ["load", "stretch"]
+    assert all(e["seconds"] >= 0 for e in events)
+
+    path = tmp_path / "profile.jsonl"
+    with Profiler(str(path)) as profiler:
+        profiler.add(0, events)
+        profiler.add(1, events)
+
+    summary = profiler.summary()
+    assert summary["mixtures"] == 2
+    assert summary["stages"]["load"]["count"] == 2
+    assert summary["stages"]["load"]["bytes"] == 800
+    assert summary["stages"]["load"]["cache_hit"] == 2
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line.get("mixture_index") for line in lines] == [0, 1, None]
+    assert lines[-1]["summary"]["stages"]["stretch"]["count"] == 2
@@ -0,0 +1,35 @@
+import pytest
+
+from stem_mixer.runs import RunManifest
+
+
+def test_run_manifest(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    config = {"seed": 1, "gain_range_db": (-3, 3)}
+    stems = [{"stem_name": "track0.wav"}, {"stem_name": "track1.wav"}]
+
+    manifest = RunManifest(path, config=config)
+    manifest.add(0, "1_00000000", stems)
+    manifest.add(2, "1_00000002", stems)
+
+    # simulate a crash while a line was being written
+    with open(path, "a") as f:
+        f.write('{"mixture_index": 3, "mixt')
+
+    manifest = RunManifest(path, config=config, resume=True)
+    assert manifest.pending(range(4)) == [1, 3]
+
+    manifest.add(1, "1_00000001", stems)
+    manifest = RunManifest(path, config=config, resume=True)
+    assert manifest.pending(range(4)) == [3]
+
+    with pytest.raises(ValueError):
+        RunManifest(path, config={"seed": 2}, resume=True)
+
+    # without resume, a log with the same configuration is kept
+    manifest = RunManifest(path, config=config)
+    assert manifest.pending(range(4)) == [3]
+
+    # and a log with another configuration is started over
+    manifest = RunManifest(path, config={"seed": 2})
+    assert manifest.pending(range(4)) == [0, 1, 2, 3]
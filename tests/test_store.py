@@ -0,0 +1,48 @@
+import pickle
+
+import pytest
+
+import numpy as np
+import pandas as pd
+import soundfile as sf
+
+from stem_mixer import audio
+from stem_mixer.metadata import read_index, write_index
+from stem_mixer.store import StemStore, pack
+
+
+@pytest.mark.parametrize("dtype, atol", [("float32", 1e-6), ("int16", 1e-4)])
+def test_pack(tmp_path, dtype, atol):
+    sr = 8000
+    names = ["a.wav", "b.wav", "c.wav"]
+    for i, name in enumerate(names):
+        tone = np.sin(np.arange((i + 1) * sr) / (i + 2))
+        sf.write(tmp_path / name, 0.5 * tone, sr)
+    write_index(
+        pd.DataFrame(
+            {
+                "stem_name": names,
+                "trim_start": [0.25, None, 0.5],
+                "trim_end": [0.75, None, 2.5],
+            }
+        ),
+        str(tmp_path / "index.csv"),
+    )
+
+    df = pack(str(tmp_path), sr=sr, dtype=dtype)
+    assert list(df["pack_length"]) == [sr // 2, 2 * sr, 2 * sr]
+    index = read_index(str(tmp_path / "index.csv"))
+    assert list(index["pack_offset"]) == list(df["pack_offset"])
+
+    store = pickle.loads(pickle.dumps(StemStore(str(tmp_path / "stems.npy"))))
+    for stem in df.to_dict("records"):
+        offset = 0.6 if stem["stem_name"] != "b.wav" else 0.1
+        y, _ = audio.load(
+            str(tmp_path / stem["stem_name"]), sr=sr, offset=offset, duration=0.1
+        )
+        z = store.get(stem, sr=sr, offset=offset, duration=0.1)
+        assert z.dtype == np.float32
+        np.testing.assert_allclose(z, y, atol=atol)
+
+        # not packed at this sample rate
+        assert store.get(stem, sr=sr // 2, offset=offset) is None
@@ -0,0 +1,37 @@
+import json
+import os
+import tarfile
+
+import numpy as np
+import pytest
+
+from stem_mixer.writers import ShardWriter
+
+
+def test_shard_writer(tmp_path):
+    sr = 8000
+    mixture = np.linspace(-0.5, 0.5, sr, dtype=np.float32)
+    stems = [{"stem_name": "track0.wav", "audio": mixture, "rms": np.float32(0.3)}]
+
+    with ShardWriter(str(tmp_path), sr=sr, shard_size=1) as writer:
+        ids = [writer.write(mixture, stems) for _ in range(2)]
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "shard-000000.tar", "shard-000001.tar", "shards.jsonl"
+    ]
+
+    with open(tmp_path / "shards.jsonl") as f:
+        entries = [json.loads(line) for line in f]
+    assert [e["mixture_id"] for e in entries] == ids
+
+    entry = entries[1]
+    offset, size = entry["members"][f"{ids[1]}.json"]
+    with open(tmp_path / entry["shard"], "rb") as f:
+        f.seek(offset)
+        metadata = json.loads(f.read(size))
+    assert metadata == [{"stem_name": "track0.wav", "rms": pytest.approx(0.3)}]
+
+    with tarfile.open(tmp_path / "shard-000000.tar") as tar:
+        assert tar.getnames() == [
+            f"{ids[0]}.mixture.wav", f"{ids[0]}.stem0.wav", f"{ids[0]}.json"
+        ]